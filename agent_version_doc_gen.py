@@ -1,27 +1,86 @@
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
 import os
+import asyncio
 import logging
+import threading
 import subprocess
 from datetime import datetime
-from langchain.tools import tool
-from langchain.tools import StructuredTool
-from langchain.agents import initialize_agent
-from langchain.agents import AgentType
 import re
+from git_backend import GitRepository
+from doc_gen import has_source_changes
+from diff_preprocess import empty_changes, structured_diff, diff_text
+from symbol_diff import summarize_symbol_changes
+from token_budget import plan_diff
 
 # Configurations
 DOCUMENTATION_FILE = "documentation.md"
 DOC_BRANCH = "documentation"
+DIFF_TOKEN_BUDGET = int(os.getenv("DOC_GEN_DIFF_TOKEN_BUDGET", 2500))
+# Caps on one agent run: model round-trips, and prompt + completion tokens over all of them (0 = no limit)
+AGENT_MAX_STEPS = int(os.getenv("DOC_GEN_AGENT_MAX_STEPS", 10))
+AGENT_MAX_TOKENS = int(os.getenv("DOC_GEN_AGENT_MAX_TOKENS", 200000))
+# Push the documentation branch after committing (0: commit locally only)
+PUSH_ENABLED = os.getenv("DOC_GEN_PUSH", "1") != "0"
 
-# Load environment variables from .env file
-load_dotenv()
+AGENT_SYSTEM_PROMPT = """You are an expert developer and technical writer maintaining the documentation of a git repository.
+Request every tool call you need for a step at once: independent tool calls made together run concurrently,
+and each extra round-trip counts against a limited number of steps."""
 
 # Configure some basic levl of logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Creating a GPT-4o model
-llm = ChatOpenAI(model='gpt-4o', temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
+# Long-lived git backend (persistent cat-file processes) shared by all git queries
+repo = GitRepository()
+
+# Repository snapshot the tools serve from during an agent run (see get_snapshot)
+snapshot = None
+# Files written by the tools during this run, so reading them back returns what was written
+written_files = {}
+
+
+class RepoSnapshot:
+    """
+    Immutable view of the repository for one agent run: the files tracked at HEAD, their contents and the
+    diff since the last documented commit. Contents come from the object database and are memoized, and the
+    diff is computed once, so repeated and concurrent tool calls never re-read files or start git again.
+    """
+
+    def __init__(self, last_commit=None):
+        self.commit = repo.rev_parse("HEAD")
+        self.last_commit = last_commit
+        self.blobs = dict(repo.ls_tree(self.commit))
+        self.files = sorted(self.blobs)
+        self._contents = {}
+        self._diff = None
+        self._lock = threading.Lock()
+        # Separate from the diff lock, so reading files does not wait for the diff
+        self._read_lock = threading.Lock()
+
+    def read(self, path):
+        """Return the text of a tracked file, or None if it is not tracked or not text."""
+        with self._read_lock:
+            if path not in self._contents:
+                blob_sha = self.blobs.get(path)
+                data = repo.read_blob(blob_sha) if blob_sha else None
+                try:
+                    self._contents[path] = data.decode("utf-8") if data is not None else None
+                except UnicodeDecodeError:
+                    self._contents[path] = None
+            return self._contents[path]
+
+    @property
+    def diff(self):
+        with self._lock:
+            if self._diff is None:
+                self._diff = get_repo_diff(self.last_commit) if self.last_commit else ""
+            return self._diff
+
+
+def get_snapshot():
+    """Return the snapshot of the current agent run, taking one of HEAD if no run started it."""
+    global snapshot
+    if snapshot is None:
+        snapshot = RepoSnapshot(get_last_documented_commit(DOCUMENTATION_FILE))
+    return snapshot
 
 
 #################################
@@ -34,10 +93,11 @@ def update_sections(existing_content, changes):
     """
 
     # Update File Structure section
-    if changes["added"] or changes["deleted"]:
+    if changes["added"] or changes["deleted"] or changes["renamed"]:
+        renamed = ", ".join(f"{old} -> {new}" for old, new in changes["renamed"])
         existing_content = re.sub(
             r"(## File Structure.*?)\n\n",
-            f"\\1\n\n### Changes:\n- Added: {', '.join(changes['added'])}\n- Deleted: {', '.join(changes['deleted'])}\n\n",
+            f"\\1\n\n### Changes:\n- Added: {', '.join(changes['added'])}\n- Deleted: {', '.join(changes['deleted'])}\n- Renamed: {renamed}\n\n",
             existing_content,
             flags=re.DOTALL
         )
@@ -67,53 +127,45 @@ def get_last_documented_commit(file_path="documentation.md"):
 
 def get_new_commits(since_commit=None):
     """Returns a list of commit messages and hashes since the provided commit."""
-    if since_commit:
-        cmd = ["git", "log", f"{since_commit}..HEAD", "--oneline"]
-    else:
-        # If no last commit found, return the full log.
-        cmd = ["git", "log", "--oneline"]
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        commits = result.stdout.strip().split("\n")
-        return commits if commits != [''] else []
+        # If no last commit found, return the full log.
+        return repo.log_oneline(since_commit)
     except subprocess.CalledProcessError as e:
         logging.error("Error retrieving git log: " + e.stderr)
         return []
 
-def get_diff_since_commit(since_commit=None):
-    """Returns the diff of changes since the provided commit."""
-    if not since_commit:
-        # No commit provided, diff from the beginning (or current working tree)
-        since_commit = ""
-    cmd = ["git", "diff", f"{since_commit}..HEAD"]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logging.error("Error retrieving git diff: " + e.stderr)
-        return ""
+def get_change_summary(since_commit):
+    """
+    Returns a compact summary of changes since the provided commit: added, removed and modified
+    functions/classes for Python files, and the most important hunks of the raw diff for other files.
+    """
+    changes = get_structured_git_diff(since_commit)
+    summary, other_files = summarize_symbol_changes(repo, since_commit, changes)
+    other_files = [f for f in other_files if f != DOCUMENTATION_FILE]
+    if other_files:
+        try:
+            # Whitespace-only hunks are left out and notebooks are diffed by their cell sources
+            other_diff = diff_text(repo, since_commit, paths=other_files)
+        except subprocess.CalledProcessError as e:
+            logging.error("Error retrieving git diff: " + e.stderr)
+            other_diff = ""
+        # Keep the most important hunks within the token budget instead of cutting the diff off
+        other_diff, _ = plan_diff(other_diff, DIFF_TOKEN_BUDGET)
+        summary = f"{summary}\n\n{other_diff}".strip()
+    return summary
 
 def get_structured_git_diff(since_commit):
-    """Parses git diff into structured categories: added, modified, deleted files."""
-    cmd = ["git", "diff", "--name-status", f"{since_commit}..HEAD"]
+    """
+    Parses git diff into structured categories: added, modified, deleted, renamed and copied files
+    (generated files and whitespace-only edits are left out, see diff_preprocess.py).
+    """
+    if not since_commit:
+        return empty_changes()
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        changes = result.stdout.strip().split("\n")
-
-        categorized_changes = {"added": [], "modified": [], "deleted": []}
-
-        for change in changes:
-            if change.startswith("A"):
-                categorized_changes["added"].append(change[2:])
-            elif change.startswith("M"):
-                categorized_changes["modified"].append(change[2:])
-            elif change.startswith("D"):
-                categorized_changes["deleted"].append(change[2:])
-
-        return categorized_changes
+        return structured_diff(repo, since_commit)
     except subprocess.CalledProcessError as e:
         logging.error(f"Error retrieving git diff: {e.stderr}")
-        return {"added": [], "modified": [], "deleted": []}
+        return empty_changes()
 
 def get_repo_overview():
     """
@@ -142,81 +194,81 @@ def get_repo_overview():
     return overview
 
 def get_repo_diff(since_commit):
-    """Returns a diff of changes since the provided commit."""
-    cmd = ["git", "diff", f"{since_commit}..HEAD"] if since_commit else ["git", "diff"]
+    """Returns a diff of changes since the provided commit, preprocessed for the prompt (see diff_preprocess.py)."""
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
+        return (diff_text(repo, since_commit) if since_commit else repo.run("diff")).strip()
     except subprocess.CalledProcessError:
         return ""
 
-def get_repo_files():
-    """Returns a list of all files in the repository."""
-    return [f for f in os.listdir(".") if os.path.isfile(f) and f != "documentation_generator.py"]
-
 ###################
 ## Tools Section ##
 ################### 
 
-@tool
 def read_file(file_path: str) -> str:
     """Reads the content of a given file."""
-    if not os.path.isfile(file_path):
+    if file_path in written_files:
+        return written_files[file_path]
+    current = get_snapshot()
+    if file_path in current.blobs and file_path != DOCUMENTATION_FILE:
+        content = current.read(file_path)
+    elif os.path.isfile(file_path):
+        # The documentation (often untracked or modified) and files not tracked at HEAD come from the working tree
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except UnicodeDecodeError:
+            content = None
+    else:
         return f"File {file_path} not found."
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception:
+    if content is None:
         return f"Unable to read {file_path}. Might be binary."
+    return content
 
-@tool
 def write_file(file_path: str, content: str) -> str:
     """Writes content to a file, creating or updating it."""
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(content)
+    written_files[file_path] = content
     return f"File {file_path} updated."
 
-@tool
 def get_git_diff() -> str:
-    """Returns the git diff of the repository."""
-    last_commit = get_last_documented_commit()
-    return get_repo_diff(last_commit)
+    """Returns the git diff of the repository since the last documented commit."""
+    return get_snapshot().diff
 
-@tool
 def list_repo_files() -> str:
-    """Lists all files in the repository."""
-    return "\n".join(get_repo_files())
+    """Lists all files tracked in the repository."""
+    return "\n".join(get_snapshot().files)
 
-@tool
 def github_documentation_commit(commit_message=""):
     """
     Commits the current changes to the 'documentation' branch of the Github repository.
     This tool is designed to be used after updating the documentation file.
     """
-    branch_name = "documentation"
     commit_message_main = f"{commit_message} - {datetime.now().strftime('%d-%m-%y %H:%M:%S')}"
-    
+    # The Markdown files written during this run, committed with git plumbing (no checkout, index untouched)
+    paths = [path for path in written_files if path.endswith(".md")]
+    if not paths and os.path.isfile(DOCUMENTATION_FILE):
+        paths = [DOCUMENTATION_FILE]
+
     try:
-        # Switch to the "documentation" branch (or create it if it doesn't exist)
-        result = subprocess.run(["git", "checkout", "-B", branch_name], check=True, capture_output=True, text=True)
-        logging.info(result.stdout)
-        
-        # Add only .md files
-        result = subprocess.run(["git", "add", "*.md"], check=True, capture_output=True, text=True)
-        logging.info(result.stdout)
-        
-        # Commit with the message
-        result = subprocess.run(["git", "commit", "-m", commit_message_main], check=True, capture_output=True, text=True)
-        logging.info(result.stdout)
-        
+        files = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                files[path] = f.read()
+        commit = repo.commit_files(DOC_BRANCH, files, commit_message_main, upstream=repo.tracking_ref(DOC_BRANCH))
+        logging.info(f"Committed {paths} to {DOC_BRANCH} as {commit[:12]}")
+
         # Push to the remote repository
-        result = subprocess.run(["git", "push", "-u", "origin", branch_name], check=True, capture_output=True, text=True)
-        logging.info(result.stdout)
+        if PUSH_ENABLED:
+            repo.run("push", "origin", f"refs/heads/{DOC_BRANCH}:refs/heads/{DOC_BRANCH}")
     except subprocess.CalledProcessError as e:
-        logging.error("An error occurred during Git operations: " + e.stderr)
+        logging.error("An error occurred during Git operations: " + (e.stderr or str(e)))
+        return "Failed to commit documentation"
+    except (OSError, ValueError, RuntimeError) as e:
+        logging.error(f"An error occurred during Git operations: {e}")
         return "Failed to commit documentation"
-    
-    return "Committed to Github on branch 'documentation'"
+
+    return f"Committed to Github on branch '{DOC_BRANCH}'"
 
 def create_file_tool(file_contents: str, file_path: str) -> str:
     """
@@ -230,9 +282,9 @@ def create_file_tool(file_contents: str, file_path: str) -> str:
         file_contents = file_contents.strip("```").strip()
 
     try:
-        head_commit = subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error retrieving HEAD commit: {e.stderr}")
+        head_commit = repo.rev_parse("HEAD")
+    except ValueError as e:
+        logging.error(f"Error retrieving HEAD commit: {e}")
         head_commit = "unknown"
 
     new_marker_line = f"Last Documented Commit: {head_commit}"
@@ -255,11 +307,11 @@ def create_file_tool(file_contents: str, file_path: str) -> str:
 
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(updated_content)
+    written_files[file_path] = updated_content
 
     return "File updated"
 
 
-@tool
 def check_document_file_exists() -> str:
     """
     Checks if the repository has a file named 'documentation.md'.    
@@ -269,9 +321,82 @@ def check_document_file_exists() -> str:
     else:
         return "File 'documentation.md' does not exist"
 
-# Convert the create_file_tool into a StructuredTool
-create_file_tool = StructuredTool.from_function(create_file_tool)
-tools = [github_documentation_commit, create_file_tool, check_document_file_exists, read_file, write_file, get_git_diff, list_repo_files]
+def build_tools():
+    """Wrap the tool functions for the agent (LangChain is only imported once an agent is actually run)."""
+    from langchain.tools import tool
+    from langchain.tools import StructuredTool
+
+    # Convert the create_file_tool into a StructuredTool
+    return [tool(github_documentation_commit), StructuredTool.from_function(create_file_tool),
+            tool(check_document_file_exists), tool(read_file), tool(write_file), tool(get_git_diff),
+            tool(list_repo_files)]
+
+def build_llm():
+    """
+    Create the agent's chat model: each turn is routed by size to the small or the large model, through the
+    rate-limit-aware client (which also handles retries) and the persistent response cache.
+    """
+    from dotenv import load_dotenv
+    from langchain_openai import ChatOpenAI
+    from llm_client import as_chat_model
+    from model_router import build_router
+    from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    def make_llm(model, base_url):
+        return ChatOpenAI(model=model, temperature=0, api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                          base_url=base_url)
+
+    return as_chat_model(build_router(make_llm, ResponseCache() if RESPONSE_CACHE_ENABLED else None))
+
+def build_agent_executor(tools, llm, max_steps=AGENT_MAX_STEPS, max_tokens=AGENT_MAX_TOKENS):
+    """
+    Create a tool-calling agent: the model can request several tools in one turn, and the executor runs them
+    concurrently when invoked asynchronously. Returns (executor, token budget callback); pass the callback in the
+    run config so the executor stops once the run has used `max_tokens`.
+    """
+    from typing import Any
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    class TokenBudget(BaseCallbackHandler):
+        def __init__(self, limit):
+            self.limit = limit
+            self.used = 0
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    self.used += usage.get("total_tokens", 0)
+
+        @property
+        def exhausted(self):
+            return bool(self.limit) and self.used >= self.limit
+
+    class BudgetedAgentExecutor(AgentExecutor):
+        token_budget: Any = None
+
+        def _should_continue(self, iterations, time_elapsed):
+            if self.token_budget is not None and self.token_budget.exhausted:
+                logging.warning(f"Agent stopped after using {self.token_budget.used} of {self.token_budget.limit} tokens")
+                return False
+            return super()._should_continue(iterations, time_elapsed)
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", AGENT_SYSTEM_PROMPT),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+    token_budget = TokenBudget(max_tokens)
+    executor = BudgetedAgentExecutor(
+        agent=create_tool_calling_agent(llm, tools, prompt), tools=tools, max_iterations=max_steps or None,
+        token_budget=token_budget, verbose=True,
+    )
+    return executor, token_budget
 
 
 ######################
@@ -279,6 +404,7 @@ tools = [github_documentation_commit, create_file_tool, check_document_file_exis
 ######################
 
 def run_agent():
+    global snapshot
     # Check for last documented commit
     last_commit = get_last_documented_commit(DOCUMENTATION_FILE)
 
@@ -312,9 +438,14 @@ def run_agent():
         """
 
     else:
+        # Fast path: nothing but the documentation changed, so there is nothing for the agent to do
+        if not has_source_changes(last_commit):
+            logging.info(f"No changes since the last documented commit {last_commit}; nothing to do")
+            return
+
         # Existing documentation found; update it based on recent changes.
         new_commits = get_new_commits(last_commit)
-        diff_details = get_diff_since_commit(last_commit)
+        diff_details = get_change_summary(last_commit)
 
         if not new_commits:
             logging.info("No new commits found since the last documented commit.")
@@ -332,7 +463,7 @@ def run_agent():
         {new_commits}
 
         ## Code Changes Summary:
-        {diff_details[:10000]}  <!-- Limiting output to avoid exceeding token limits -->
+        {diff_details}
 
         ## Update Instructions:
         - **Enhance Documentation:** Incorporate these changes into the documentation.
@@ -349,13 +480,16 @@ def run_agent():
         - Push the new documentation to the repository.
         """
 
+    # Tools serve files and the diff from one snapshot for the whole run
+    snapshot = RepoSnapshot(last_commit)
+    written_files.clear()
+
     # Initialize and invoke the agent with the dynamic prompt
-    agent_executor = initialize_agent(
-        tools, llm, agent=AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION, verbose=True
-    )
+    agent_executor, token_budget = build_agent_executor(build_tools(), build_llm())
 
-    # Invoke the agent with the dynamic prompt
-    agent_executor.invoke({"input": prompt_template})
+    # Invoke the agent asynchronously, so the tool calls of each step run concurrently
+    asyncio.run(agent_executor.ainvoke({"input": prompt_template}, config={"callbacks": [token_budget]}))
+    logging.info(f"Agent finished using {token_budget.used} tokens")
 
 if __name__ == "__main__":
     run_agent()
\ No newline at end of file
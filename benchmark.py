@@ -0,0 +1,284 @@
+"""
+Offline benchmarks for doc_gen.py.
+
+Generates a synthetic git repository, replaces the OpenAI model with the deterministic FakeChatModel
+and reports wall time, peak memory and prompt tokens for each phase:
+
+    python benchmark.py --files 100 1000 --file-size 4000 --commits 20 --latency 0.05
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import threading
+import itertools
+import contextvars
+import tracemalloc
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_llm import CALL_TAGS, FakeChatModel
+
+def _git(repo_path, *args):
+    return subprocess.run(['git', *args], cwd=repo_path, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _python_source(rng, module, size):
+    """Generate plausible Python source of roughly `size` bytes."""
+    parts = [f'"""Synthetic module {module}."""\nimport os\n\nCONSTANT_{rng.randint(0, 999)} = {rng.randint(0, 99)}\n']
+    length = len(parts[0])
+    index = 0
+    while length < size:
+        index += 1
+        args = ", ".join(f"arg{i}" for i in range(rng.randint(0, 4)))
+        body = "\n".join(f"    value_{i} = {rng.randint(0, 9999)} * {i}" for i in range(rng.randint(1, 8)))
+        part = f'\n\ndef function_{index}({args}):\n    """Compute value {index}."""\n{body}\n    return {index}\n'
+        if rng.random() < 0.2:
+            part = f"\n\nclass Component{index}:\n    def run(self):\n        return {index}\n" + part
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def create_synthetic_repo(path, files=100, file_size=2000, commits=10, changes_per_commit=5, depth=3, seed=0):
+    """
+    Create a git repository with `files` Python files (about `file_size` bytes each) spread over nested
+    directories, followed by `commits` commits that each modify, add or delete `changes_per_commit` files.
+    A local bare repository is configured as `origin` so pushes work offline. Returns the list of commit SHAs.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    _git(path, 'init', '-q', '-b', 'main')
+    # Set in the repository itself, so the commits doc_gen makes there work without a global git identity
+    _git(path, 'config', 'user.name', 'bench')
+    _git(path, 'config', 'user.email', 'bench@example.com')
+    origin = f"{path.rstrip(os.sep)}-origin.git"
+    subprocess.run(['git', 'init', '-q', '--bare', origin], check=True)
+    _git(path, 'remote', 'add', 'origin', origin)
+
+    paths = []
+    for i in range(files):
+        directories = [f"pkg{rng.randint(0, 3)}" for _ in range(rng.randint(0, depth))]
+        paths.append(os.path.join(*directories, f"module_{i}.py"))
+    with open(os.path.join(path, "README.md"), "w") as f:
+        f.write("# Synthetic repository\n\nGenerated for benchmarking.\n")
+    for file_path in paths:
+        full_path = os.path.join(path, file_path)
+        os.makedirs(os.path.dirname(full_path) or path, exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(_python_source(rng, file_path, file_size))
+    _git(path, 'add', '-A')
+    _git(path, 'commit', '-q', '-m', 'Initial commit')
+    history = [_git(path, 'rev-parse', 'HEAD')]
+
+    for n in range(commits):
+        for _ in range(changes_per_commit):
+            action = rng.random()
+            if action < 0.7 and paths:
+                file_path = rng.choice(paths)
+                with open(os.path.join(path, file_path), "a") as f:
+                    f.write(f"\n\ndef added_in_commit_{n}_{rng.randint(0, 99999)}(x):\n    return x\n")
+            elif action < 0.9 or not paths:
+                file_path = f"module_new_{n}_{rng.randint(0, 99999)}.py"
+                with open(os.path.join(path, file_path), "w") as f:
+                    f.write(_python_source(rng, file_path, file_size))
+                paths.append(file_path)
+            else:
+                file_path = paths.pop(rng.randrange(len(paths)))
+                os.remove(os.path.join(path, file_path))
+        _git(path, 'add', '-A')
+        _git(path, 'commit', '-q', '-m', f'Commit {n}')
+        history.append(_git(path, 'rev-parse', 'HEAD'))
+    return history
+
+
+class PhaseRecorder:
+    """
+    Collects wall time, peak traced memory and fake-LLM token counts per named phase. Phases may nest
+    and may run concurrently in worker threads: each fake-LLM call is tagged with the phases active in
+    the calling context, and the single tracemalloc peak is credited to every phase active at the time.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.results = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Peak memory seen so far by each active phase (tracemalloc has a single, process-wide peak counter)
+        self._peaks = {}
+
+    def _collect_peak(self):
+        """Credit the traced peak since the last reset to every active phase and reset it (lock held)."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for phase in self._peaks:
+            self._peaks[phase] = max(self._peaks[phase], peak)
+        tracemalloc.reset_peak()
+
+    def measure(self, name, func, *args, **kwargs):
+        phase = next(self._ids)
+        with self._lock:
+            calls_before = len(self.model.calls)
+            # Only the outermost phase starts and stops tracing
+            if self._peaks:
+                self._collect_peak()
+            else:
+                tracemalloc.start()
+            self._peaks[phase] = 0
+        token = CALL_TAGS.set(CALL_TAGS.get() + (phase,))
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            CALL_TAGS.reset(token)
+            with self._lock:
+                self._collect_peak()
+                peak = self._peaks.pop(phase)
+                if not self._peaks:
+                    tracemalloc.stop()
+                calls = [call for call in self.model.calls[calls_before:] if phase in call["tags"]]
+                # Repeated phases (e.g. one LLM call per file) are aggregated into a single row
+                row = self.results.setdefault(name, {
+                    "phase": name, "count": 0, "wall_time_s": 0.0, "peak_memory_mb": 0.0,
+                    "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                })
+                row["count"] += 1
+                row["wall_time_s"] = round(row["wall_time_s"] + elapsed, 4)
+                row["peak_memory_mb"] = max(row["peak_memory_mb"], round(peak / 1024 / 1024, 2))
+                row["llm_calls"] += len(calls)
+                row["prompt_tokens"] += sum(call["input_tokens"] for call in calls)
+                row["completion_tokens"] += sum(call["output_tokens"] for call in calls)
+
+    def wrap(self, module, name):
+        """Replace `module.name` with a version that is measured as its own phase."""
+        original = getattr(module, name)
+
+        def wrapper(*args, **kwargs):
+            return self.measure(name, original, *args, **kwargs)
+
+        setattr(module, name, wrapper)
+        return original
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool that runs each task in a copy of the submitting context, so worker calls keep their phase tags."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def run_scenarios(repo_path, history, model):
+    """Run the doc_gen scenarios inside `repo_path` and return the recorded phases."""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    cwd = os.getcwd()
+    os.chdir(repo_path)
+    try:
+        import doc_gen
+        import map_reduce
+        from git_backend import GitRepository
+        from llm_client import LLMClient
+
+        doc_gen.repo = GitRepository()
+        # The fake model is measured without client-side rate limits
+        doc_gen.llm_client = LLMClient(model, requests_per_minute=0, tokens_per_minute=0)
+        recorder = PhaseRecorder(model)
+
+        recorder.measure("get_complete_repo_content", doc_gen.get_complete_repo_content)
+        recorder.measure("get_structured_diff", doc_gen.get_structured_diff, history[0])
+        documented = _git(repo_path, 'ls-tree', '-r', '--name-only', history[0]).splitlines()[:50]
+        existing = "# Documentation\n\n" + "\n\n".join(
+            f"## Section {i}\nDescribes `{path}` in detail. " + "lorem ipsum " * 200 for i, path in enumerate(documented)
+        ) + f"\n\n## Recent Changes\nNone yet.\n\nLast Documented Commit: {history[0]}"
+        recorder.measure("update_documentation_file", doc_gen.update_documentation_file, "## New changes\nText", existing)
+
+        # Full pipeline, with each doc_gen phase measured separately
+        for module in (doc_gen, map_reduce):
+            module.ThreadPoolExecutor = ContextThreadPoolExecutor
+        originals = {name: recorder.wrap(doc_gen, name) for name in (
+            "get_complete_repo_content", "get_repo_summaries", "get_hierarchical_summaries", "get_structured_diff",
+            "regenerate_stale_sections", "generate_documentation_content", "update_documentation_file",
+            "commit_to_documentation_branch",
+        )}
+        try:
+            _git(repo_path, 'checkout', '-q', 'main')
+            if os.path.exists(doc_gen.DOCUMENTATION_FILE):
+                os.remove(doc_gen.DOCUMENTATION_FILE)
+            recorder.measure("main_flow (initial)", doc_gen.main_flow)
+
+            _git(repo_path, 'checkout', '-q', 'main')
+            with open(doc_gen.DOCUMENTATION_FILE, "w") as f:
+                f.write(existing)
+            doc_gen.repo.clear_cache()
+            recorder.measure("main_flow (incremental)", doc_gen.main_flow)
+
+            # Nothing committed since the last update: should exit without calling the model
+            _git(repo_path, 'checkout', '-q', 'main')
+            with open(doc_gen.DOCUMENTATION_FILE, "w") as f:
+                f.write(_git(repo_path, 'show', f"{doc_gen.DOC_BRANCH}:{doc_gen.DOCUMENTATION_FILE}"))
+            doc_gen.repo.clear_cache()
+            recorder.measure("main_flow (no-op)", doc_gen.main_flow)
+        finally:
+            for name, original in originals.items():
+                setattr(doc_gen, name, original)
+            for module in (doc_gen, map_reduce):
+                module.ThreadPoolExecutor = ThreadPoolExecutor
+            doc_gen.repo.close()
+            doc_gen.llm_client.close()
+        return list(recorder.results.values())
+    finally:
+        os.chdir(cwd)
+
+
+def print_report(label, results):
+    print(f"\n{label}")
+    print(f"{'phase':<34}{'runs':>6}{'wall (s)':>10}{'peak MB':>9}{'llm calls':>11}{'prompt tok':>12}{'compl tok':>11}")
+    for row in results:
+        print(f"{row['phase']:<34}{row['count']:>6}{row['wall_time_s']:>10.3f}{row['peak_memory_mb']:>9.2f}"
+              f"{row['llm_calls']:>11}{row['prompt_tokens']:>12}{row['completion_tokens']:>11}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for doc_gen.py")
+    parser.add_argument("--files", type=int, nargs="+", default=[50, 500], help="File counts to benchmark")
+    parser.add_argument("--file-size", type=int, default=2000, help="Approximate size of each file in bytes")
+    parser.add_argument("--commits", type=int, default=10, help="Number of commits after the initial one")
+    parser.add_argument("--changes-per-commit", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.01, help="Fake LLM time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Fake LLM output throughput")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated repositories")
+    args = parser.parse_args(argv)
+
+    # Run doc_gen from this checkout regardless of the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = []
+    workdir = tempfile.mkdtemp(prefix="doc_gen_bench_")
+    try:
+        for files in args.files:
+            repo_path = os.path.join(workdir, f"repo_{files}")
+            start = perf_counter()
+            history = create_synthetic_repo(repo_path, files, args.file_size, args.commits,
+                                            args.changes_per_commit, seed=args.seed)
+            print(f"Generated {files} files / {len(history)} commits in {perf_counter() - start:.2f}s: {repo_path}")
+            model = FakeChatModel(args.latency, args.tokens_per_second, args.completion_tokens)
+            results = run_scenarios(repo_path, history, model)
+            print_report(f"files={files} file_size={args.file_size} commits={args.commits}", results)
+            report.append({"files": files, "file_size": args.file_size, "commits": args.commits, "phases": results})
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Content compaction for full-repository prompts.
+
+Documenting an API does not need function bodies, so instead of embedding every file in full, the most important
+files keep their full source (within DOC_GEN_FULL_SOURCE_TOKEN_BUDGET) and the rest are represented by a skeleton:
+for Python, parsed with `ast`, the module docstring, the signatures of public classes and functions with their
+decorators and the summary paragraph of their docstrings, class attributes and top-level constants; for other
+languages, a heuristic outline of their declaration lines and doc comments. Files without a skeleton that do not fit
+are listed by name, and byte-identical copies are included once.
+
+Compaction applies to prompts built from file contents (doc_gen with DOC_GEN_SUMMARY_CACHE=0); the per-file summary
+and map-reduce paths send summaries and do not use it.
+"""
+import os
+import re
+import ast
+import hashlib
+import logging
+import posixpath
+
+import metrics
+from token_budget import (PROMPT_TOKEN_BUDGET, count_tokens, python_imports, import_in_degree, is_entry_point,
+                          score_file, plan_budget)
+
+# Configurations
+# Tokens of full source for the most important files; every other file is represented by its skeleton
+FULL_SOURCE_TOKEN_BUDGET = int(os.getenv("DOC_GEN_FULL_SOURCE_TOKEN_BUDGET", 8000))
+MAX_CONSTANT_CHARS = 120
+MAX_DOC_COMMENT_LINES = 8
+
+PYTHON_EXTENSIONS = (".py", ".pyi", ".ipynb")
+OUTLINE_EXTENSIONS = (
+    ".js", ".jsx", ".mjs", ".ts", ".tsx", ".java", ".kt", ".scala", ".go", ".rs", ".c", ".h", ".cc", ".cpp", ".hpp",
+    ".cs", ".swift", ".rb", ".php", ".lua", ".sh",
+)
+MODIFIERS = r"(?:(?:export|default|public|private|protected|internal|static|abstract|final|sealed|async|extern|inline|" \
+            r"virtual|override|unsafe|open|data|pub(?:\([\w:]+\))?)\s+)*"
+DECLARATION_RE = re.compile(
+    r"^\s*" + MODIFIERS +
+    r"(?:(?:function\*?|class|interface|struct|enum|trait|impl|fn|func|def|module|namespace|object|record)\b"
+    r"|type\s+\w+|(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:function\b|\([^)]*\)\s*=>|\w+\s*=>))"
+    r"|^\s*(?:(?:public|private|protected|static)\s+)+[\w<>\[\],.?\s]+\("
+)
+DOC_COMMENT_RE = re.compile(r"^\s*(?:///|//!|/\*\*|\*|#(?!include|define|!))")
+CONSTANT_NAME_RE = re.compile(r"^(?:[A-Z][A-Z0-9_]*|__\w+__)$")
+PRIVATE_NAME_RE = re.compile(r"^_(?!_\w+__$)")
+
+
+def _docstring(node, indent, summary_only=False):
+    doc = ast.get_docstring(node)
+    if doc is None:
+        return []
+    if summary_only:
+        # The first paragraph is the summary; details, parameters and examples are left out
+        doc = doc.split("\n\n", 1)[0]
+    lines = doc.replace('"""', '\\"\\"\\"').split("\n")
+    if len(lines) == 1:
+        return [f'{indent}"""{lines[0]}"""']
+    return [f'{indent}"""{lines[0]}'] + [f"{indent}{line}" if line else "" for line in lines[1:]] + [f'{indent}"""']
+
+
+def _is_constant(node, in_class):
+    """Module-level constants (UPPER_CASE and dunder names); in classes, every attribute and field."""
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    names = [target.id for target in targets if isinstance(target, ast.Name)]
+    return len(names) == len(targets) and (in_class or all(CONSTANT_NAME_RE.match(name) for name in names))
+
+
+def _skeleton_lines(body, indent, lines, in_class=False):
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and PRIVATE_NAME_RE.match(node.name):
+            # Private helpers are implementation details
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            lines.extend(f"{indent}@{ast.unparse(decorator)}" for decorator in node.decorator_list)
+            if isinstance(node, ast.ClassDef):
+                bases = ", ".join([ast.unparse(base) for base in node.bases] + [ast.unparse(kw) for kw in node.keywords])
+                lines.append(f"{indent}class {node.name}{f'({bases})' if bases else ''}:")
+                size = len(lines)
+                lines.extend(_docstring(node, indent + "    ", summary_only=True))
+                _skeleton_lines(node.body, indent + "    ", lines, in_class=True)
+                if len(lines) == size:
+                    lines.append(f"{indent}    ...")
+            else:
+                prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                lines.append(f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){returns}:")
+                # The body is left out
+                lines.extend(_docstring(node, indent + "    ", summary_only=True) + [f"{indent}    ..."])
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)) and _is_constant(node, in_class):
+            text = ast.unparse(node)
+            lines.append(indent + (text if len(text) <= MAX_CONSTANT_CHARS else text[:MAX_CONSTANT_CHARS] + " ..."))
+        elif not in_class and isinstance(node, ast.If) and "__main__" in ast.unparse(node.test):
+            lines.extend([f"{indent}if {ast.unparse(node.test)}:", f"{indent}    ..."])
+
+
+def python_skeleton(text):
+    """Return the API skeleton of Python source, or None if it cannot be parsed."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    lines = _docstring(tree, "")
+    _skeleton_lines(tree.body, "", lines)
+    return "\n".join(lines)
+
+
+def outline_skeleton(text):
+    """
+    Return a heuristic outline of source in other languages: declaration lines (bodies cut at the opening brace)
+    with the doc comments right above them, or None if no declaration is recognised.
+    """
+    lines, comments = [], []
+    for line in text.splitlines():
+        if DECLARATION_RE.match(line):
+            lines.extend(comments[-MAX_DOC_COMMENT_LINES:])
+            comments = []
+            line = line.rstrip()
+            if "{" in line:
+                line = line[:line.index("{") + 1] + " ... }"
+            lines.append(line)
+        elif DOC_COMMENT_RE.match(line):
+            comments.append(line.rstrip())
+        else:
+            comments = []
+    return "\n".join(lines) if lines else None
+
+
+def skeleton(path, text):
+    """Return the skeleton of a file by its extension, or None if it has none."""
+    extension = posixpath.splitext(path)[1].lower()
+    if extension in PYTHON_EXTENSIONS:
+        return python_skeleton(text)
+    if extension in OUTLINE_EXTENSIONS:
+        return outline_skeleton(text)
+    return None
+
+
+def compact_sources(make_sources, budget=PROMPT_TOKEN_BUDGET, full_budget=FULL_SOURCE_TOKEN_BUDGET):
+    """
+    Return the repository as compact prompt text. `make_sources()` returns a fresh iterator of (path, text) pairs;
+    it is consumed twice, once to measure and rank the files and once to emit the full sources that were chosen,
+    so full file contents are never all held in memory.
+
+    Files are ranked by importance (README, entry points, import in-degree). In that order, each file is included in
+    full while `full_budget` allows, otherwise as its skeleton, otherwise only listed by name; the result is then fitted
+    into `budget`, dropping the least important files.
+    """
+    files, first_copy, duplicates, imports = [], {}, {}, {}
+    for path, text in make_sources():
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if digest in first_copy:
+            duplicates.setdefault(first_copy[digest], []).append(path)
+            continue
+        first_copy[digest] = path
+        imports[path] = python_imports(text) if path.endswith(".py") else set()
+        outline = skeleton(path, text)
+        full_tokens = count_tokens(text)
+        files.append({"name": path, "full_tokens": full_tokens, "entry_point": is_entry_point(text),
+                      "skeleton": outline if outline is not None and count_tokens(outline) < full_tokens else None})
+    in_degree = import_in_degree(imports)
+    for item in files:
+        item["score"] = score_file(item["name"], in_degree[item["name"]], is_entry_point=item.pop("entry_point"))
+
+    full_used = 0
+    for item in sorted(files, key=lambda item: -item["score"]):
+        if full_used + item["full_tokens"] <= full_budget:
+            full_used += item["full_tokens"]
+            item.update(representation="full", tokens=item["full_tokens"] + 10)
+        elif item["skeleton"] is not None:
+            item["text"] = f"### File: {item['name']} (signatures and docstrings only)\n```\n{item['skeleton']}\n```\n"
+            item.update(representation="skeleton", tokens=count_tokens(item["text"]))
+        else:
+            item.update(representation="listed", tokens=count_tokens(item["name"]) + 1)
+        item.pop("skeleton")
+
+    plan = plan_budget(files, budget)
+    selected = {item["name"]: item for item in plan.selected}
+    full_texts = {}
+    for path, text in make_sources():
+        if path in selected and selected[path]["representation"] == "full" and path not in full_texts:
+            full_texts[path] = f"### File: {path}\n```\n{text}\n```\n"
+
+    parts = [full_texts.get(item["name"], item.get("text")) for item in plan.selected
+             if item["representation"] != "listed"]
+    listed = [item["name"] for item in plan.selected if item["representation"] == "listed"]
+    if listed:
+        parts.append(f"Other files (contents not included): {', '.join(listed)}\n")
+    copies = [f"{', '.join(paths)} (identical to {path})" for path, paths in duplicates.items() if path in selected]
+    if copies:
+        parts.append(f"Identical copies (not repeated): {'; '.join(copies)}\n")
+    if plan.dropped:
+        parts.append(f"{plan.report()}\n")
+
+    counts = {}
+    for item in plan.selected:
+        counts[item["representation"]] = counts.get(item["representation"], 0) + 1
+    original = sum(item["full_tokens"] for item in files)
+    metrics.incr("compaction_tokens_saved", max(0, original - plan.used))
+    logging.info(f"Compacted repository content: {counts}, {sum(map(len, duplicates.values()))} duplicate(s); "
+                 f"about {plan.used} instead of {original} tokens")
+    return "\n".join(parts)
@@ -0,0 +1,156 @@
+"""
+Preprocessing of git diffs before they are turned into prompts.
+
+`structured_diff()` lists the changes between two revisions with rename and copy detection (`-M`/`-C`) and runs
+them through CHANGE_FILTERS, which drop changes that are not worth documenting: lockfiles, minified assets,
+vendored or generated files, and edits that only touch whitespace (or only a notebook's outputs). `diff_text()`
+renders changes as a unified diff that ignores whitespace-only hunks and shows notebooks as their cell sources.
+Indentation is significant in Python and YAML, so for those files changes of leading whitespace are kept.
+Both stages are lists of plain functions, so more preprocessors can be added.
+"""
+import difflib
+import logging
+import posixpath
+
+from repo_ingest import MAX_FILE_BYTES, TEXT_CONVERTERS, is_binary, get_skipped_files, prepare_text
+
+# `git diff --name-status` letters; type changes (T) count as modifications
+STATUSES = {"A": "added", "M": "modified", "T": "modified", "D": "deleted", "R": "renamed", "C": "copied"}
+# Files whose leading whitespace is part of their meaning (notebooks are compared as their Python cell sources)
+INDENTATION_EXTENSIONS = (".py", ".pyi", ".ipynb", ".yaml", ".yml")
+
+
+def empty_changes():
+    """A structured diff without changes. Renames and copies are (old_path, path) pairs."""
+    return {"added": [], "modified": [], "deleted": [], "renamed": [], "copied": []}
+
+
+def changed_paths(changes):
+    """Return every path touched by a structured diff (both sides of renames, the new side of copies)."""
+    paths = changes["added"] + changes["modified"] + changes["deleted"]
+    for old_path, path in changes.get("renamed", []):
+        paths += [old_path, path]
+    paths += [path for _, path in changes.get("copied", [])]
+    return paths
+
+
+def parse_name_status(output):
+    """
+    Parse `git diff --name-status -z` output into (status, path, old_path) entries; old_path is only set
+    for renames and copies, which carry a similarity score and two paths.
+    """
+    fields = output.split("\0")
+    entries = []
+    i = 0
+    while i < len(fields) and fields[i]:
+        letter = fields[i][0]
+        if letter in "RC":
+            entries.append((STATUSES[letter], fields[i + 2], fields[i + 1]))
+            i += 3
+        else:
+            if letter in STATUSES:
+                entries.append((STATUSES[letter], fields[i + 1], None))
+            i += 2
+    return entries
+
+
+def read_text(repo, revision, path):
+    """Read a file of a revision as prompt text (converted, e.g. notebooks), or None if missing or binary."""
+    data = repo.read_blob(f"{revision}:{path}", max_bytes=MAX_FILE_BYTES)
+    if data is None or is_binary(data[:8000]):
+        return None
+    return prepare_text(path, data.decode("utf-8", errors="replace"))
+
+
+def drop_generated(repo, entries, old, new):
+    """Lockfiles, minified assets and vendored or generated files (by pattern or .gitattributes)."""
+    skipped = get_skipped_files([path for _, path, _ in entries])
+    return {path: "generated or vendored" for path in skipped}
+
+
+def is_indentation_sensitive(path):
+    return posixpath.splitext(path)[1].lower() in INDENTATION_EXTENSIONS
+
+
+def normalize_whitespace(path, text):
+    """
+    Return the lines of a file with blank lines dropped, trailing whitespace removed and runs of interior
+    whitespace collapsed to one space. Leading whitespace is kept for indentation-sensitive files.
+    """
+    lines = []
+    for line in text.splitlines():
+        words = " ".join(line.split())
+        if not words:
+            continue
+        indent = line[:len(line) - len(line.lstrip())] if is_indentation_sensitive(path) else ""
+        lines.append(indent + words)
+    return lines
+
+
+def drop_whitespace_only(repo, entries, old, new):
+    """Modifications that only change whitespace, or only a notebook's outputs and metadata."""
+    dropped = {}
+    for status, path, _ in entries:
+        if status != "modified":
+            continue
+        before, after = read_text(repo, old, path), read_text(repo, new, path)
+        if before is not None and after is not None and \
+                normalize_whitespace(path, before) == normalize_whitespace(path, after):
+            dropped[path] = "whitespace or notebook outputs only"
+    return dropped
+
+
+# Each filter gets the parsed entries and returns {path: reason} for the changes to leave out
+CHANGE_FILTERS = [drop_generated, drop_whitespace_only]
+
+
+def structured_diff(repo, old, new="HEAD", include=None, filters=None):
+    """
+    Return the changes between two revisions as {"added", "modified", "deleted": [path, ...], "renamed",
+    "copied": [(old_path, path), ...]}, after CHANGE_FILTERS (or `filters`). `include` is an optional path
+    predicate; renames and copies are kept if either side matches. Raises CalledProcessError if git fails.
+    """
+    output = repo.run('diff', '--name-status', '-z', '-M', '-C', f"{old}..{new}")
+    entries = [(status, path, old_path) for status, path, old_path in parse_name_status(output)
+               if include is None or include(path) or (old_path is not None and include(old_path))]
+
+    dropped = {}
+    for change_filter in CHANGE_FILTERS if filters is None else filters:
+        remaining = [entry for entry in entries if entry[1] not in dropped]
+        if remaining:
+            dropped.update(change_filter(repo, remaining, old, new))
+    if dropped:
+        logging.info(f"Left {len(dropped)} change(s) out of the prompt: {dropped}")
+
+    changes = empty_changes()
+    for status, path, old_path in entries:
+        if path in dropped:
+            continue
+        changes[status].append((old_path, path) if old_path is not None else path)
+    return changes
+
+
+def diff_text(repo, old, new="HEAD", paths=None):
+    """
+    Return the unified diff between two revisions for `paths` (default: every change kept by structured_diff).
+    Whitespace-only changes are ignored (except changes of indentation in indentation-sensitive files) and
+    notebooks are diffed by their cell sources, without outputs.
+    """
+    if paths is None:
+        paths = changed_paths(structured_diff(repo, old, new))
+    if not paths:
+        return ""
+    converted = [path for path in paths if posixpath.splitext(path)[1].lower() in TEXT_CONVERTERS]
+    plain = [path for path in paths if path not in converted]
+    indented = [path for path in plain if is_indentation_sensitive(path)]
+    plain = [path for path in plain if path not in indented]
+
+    parts = []
+    for option, group in (('--ignore-space-change', plain), ('--ignore-space-at-eol', indented)):
+        if group:
+            parts.append(repo.run('diff', '-M', '-C', option, '--ignore-blank-lines', f"{old}..{new}", '--', *group))
+    for path in converted:
+        before = (read_text(repo, old, path) or "").splitlines()
+        after = (read_text(repo, new, path) or "").splitlines()
+        parts.append("\n".join(difflib.unified_diff(before, after, f"a/{path}", f"b/{path}", lineterm="")))
+    return "\n".join(part.strip("\n") for part in parts if part.strip())
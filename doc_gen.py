@@ -1,154 +1,627 @@
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
 import os
+import stat
+import hashlib
 import logging
+import tempfile
+import threading
+import posixpath
 import subprocess
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import re
+from repo_ingest import (MAX_FILE_BYTES, is_binary, iter_repo_content, iter_file_chunks, list_tracked_files,
+                         get_skipped_files, prepare_text)
+from git_backend import GitRepository
+from diff_preprocess import empty_changes, changed_paths, structured_diff
+from symbol_diff import symbol_changes_by_path
+from token_budget import PROMPT_TOKEN_BUDGET, count_tokens, score_file, rank_sources, plan_budget
+import metrics
+from doc_sections import (parse_sections, render_sections, iter_sections, find_section, set_body, annotate_sources,
+                          annotate_stream, stale_sections)
 
 # Configurations
 DOCUMENTATION_FILE = "documentation.md"
 DOC_BRANCH = "documentation"
+SUMMARY_CACHE_ENABLED = os.getenv("DOC_GEN_SUMMARY_CACHE", "1") != "0"
+# Files summarized at the same time when summaries are missing from the cache
+SUMMARY_MAX_WORKERS = int(os.getenv("DOC_GEN_MAX_WORKERS", 8))
+MAP_REDUCE_ENABLED = os.getenv("DOC_GEN_MAP_REDUCE", "0") == "1"
+SECTION_UPDATES_ENABLED = os.getenv("DOC_GEN_SECTION_UPDATES", "1") != "0"
+STREAMING_ENABLED = os.getenv("DOC_GEN_STREAMING", "1") != "0"
+RETRIEVAL_ENABLED = os.getenv("DOC_GEN_RETRIEVAL", "1") != "0"
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("DOC_GEN_RETRIEVAL_TOKEN_BUDGET", 4000))
+# Full-repository prompts give most files as signatures and docstrings only (see compaction.py). This only applies
+# when documentation is written from file contents (DOC_GEN_SUMMARY_CACHE=0), not from cached per-file summaries
+COMPACTION_ENABLED = os.getenv("DOC_GEN_COMPACTION", "1") != "0"
+# Push the documentation branch after every documentation commit (0: commit locally only)
+PUSH_ENABLED = os.getenv("DOC_GEN_PUSH", "1") != "0"
+
+FILE_SUMMARY_PROMPT = """You are an expert developer and technical writer.
+Summarize the file below for use in project documentation. Describe its purpose, its key modules,
+classes and functions (with their signatures), and how it relates to the rest of the project.
+Be concise and specific to the code; do not include generic placeholder text.
+
+### File: {path}
+```
+{content}
+```
+"""
+
+SECTION_PROMPT = """You are an expert developer and technical writer.
+Below is one section of the project documentation, followed by the changes made to the source files it documents.
+Rewrite the body of this section so that it accurately reflects these changes.
+{edited_note}
+**Important Instructions:**
+- Keep everything that is still accurate, and keep the same style and level of detail.
+- Output only the section body: do not repeat the section heading and do not include its subsections.
+- Do not include any generic placeholder text or markdown wrappers like '```markdown'.
+
+## Section: {title}
+{body}
+
+## Changed source files
+{changes}
+"""
 
-load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-llm = ChatOpenAI(model='gpt-4o', temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
+# The model client is created on first use (see get_llm_client), so runs with nothing to document
+# never import LangChain or the OpenAI SDK
+llm = None
+llm_client = None
+# Summary workers may ask for the client at the same time; only one of them creates it
+_llm_lock = threading.Lock()
+
+# Long-lived git backend (persistent cat-file processes) shared by all git queries
+repo = GitRepository()
+
+# Summary cache shared by all runs in this process (see get_summary_cache)
+summary_cache = None
+
+# Local BM25 index used to pick related context for updates (see get_retrieval_index)
+retrieval_index = None
+
+def get_llm_client(cache_dir=None):
+    """
+    Return the shared model client, creating it (and importing LangChain) on first use: a router sending each
+    request to the small or the large model depending on its size and kind, each behind a rate-limit-aware client
+    with a persistent response cache (in `cache_dir`, by default the git directory).
+    """
+    global llm, llm_client
+    if llm_client is not None:
+        return llm_client
+    with _llm_lock:
+        if llm_client is None:
+            from dotenv import load_dotenv
+            from langchain_openai import ChatOpenAI
+            from model_router import build_router
+            from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache
+
+            load_dotenv()
+
+            def make_llm(model, base_url):
+                # Retries are handled by the rate-limit-aware client, not by the OpenAI SDK
+                return ChatOpenAI(model=model, temperature=0, api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                                  stream_usage=True, base_url=base_url)
+
+            # Responses are cached on disk, so re-runs and retried jobs do not pay for the same prompts again
+            client = build_router(make_llm, ResponseCache(cache_dir) if RESPONSE_CACHE_ENABLED else None)
+            llm = client.llm
+            llm_client = client
+    return llm_client
 
 def get_current_commit_hash():
     """Get the current HEAD commit hash"""
     try:
-        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
-    except subprocess.CalledProcessError as e:
+        return repo.rev_parse('HEAD')
+    except ValueError as e:
         logging.error(f"Error getting commit hash: {e}")
         return None
 
-def get_structured_diff(last_commit):
-    """Get structured diff since last documented commit, excluding documentation.md"""
+def in_scope(path, scope=None):
+    """
+    Return True if `path` is a source file covered by `scope`: a path predicate selecting part of the
+    repository (e.g. one package of a monorepo), or None for the whole repository except the documentation.
+    """
+    return path != DOCUMENTATION_FILE if scope is None else scope(path)
+
+def has_source_changes(last_commit, scope=None):
+    """
+    Cheaply check whether anything other than the documentation changed since the last documented commit.
+    Errors (e.g. the commit is missing from a shallow clone) count as changes so updates are never skipped silently.
+    """
+    if get_current_commit_hash() == last_commit:
+        return False
+    try:
+        changed = repo.run('diff', '--name-only', last_commit, 'HEAD').splitlines()
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"Could not compare with the last documented commit: {e}")
+        return True
+    # Lockfiles and generated files alone are not worth a documentation update
+    changed = [path for path in changed if in_scope(path, scope)]
+    return bool(set(changed) - get_skipped_files(changed))
+
+def get_structured_diff(last_commit, scope=None):
+    """
+    Get structured diff since last documented commit, excluding documentation.md (and files outside `scope`).
+    Renames and copies are detected, and generated files and whitespace-only edits are left out (see diff_preprocess.py).
+    """
     if not last_commit:
-        return {"added": [], "modified": [], "deleted": []}
-    
+        return empty_changes()
+
     try:
-        diff_output = subprocess.check_output(
-            ['git', 'diff', '--name-status', f"{last_commit}..HEAD"]
-        ).decode().splitlines()
+        # **Exclude documentation.md**
+        return structured_diff(repo, last_commit, include=lambda path: in_scope(path, scope))
     except subprocess.CalledProcessError as e:
         logging.error(f"Error getting git diff: {e}")
-        return {"added": [], "modified": [], "deleted": []}
+        return empty_changes()
 
-    changes = {"added": [], "modified": [], "deleted": []}
-    for line in diff_output:
-        if not line:
-            continue
-        status, path = line.split(maxsplit=1)
+def generate_documentation_content(context, kind="summary"):
+    """Generate documentation using the model routed for this kind of request"""
+    response = get_llm_client().invoke(context, kind=kind)
+    return response.content
 
-        # **Exclude documentation.md**
-        if path == DOCUMENTATION_FILE:
+def stream_documentation_content(prompt, kind=None):
+    """
+    Generate documentation line by line as the model streams it, with placeholders and fences already removed.
+    Falls back to a single request when streaming is disabled or the client cannot stream (e.g. in pool workers).
+    """
+    client = get_llm_client()
+    if STREAMING_ENABLED and hasattr(client, "stream"):
+        texts = (chunk.content for chunk in client.stream(prompt, kind=kind))
+    else:
+        texts = [client.invoke(prompt, kind=kind).content]
+    yield from clean_generated_lines(iter_lines(texts))
+
+def iter_lines(texts):
+    """Split a stream of text chunks into lines."""
+    pending = ""
+    for text in texts:
+        pending += text
+        *lines, pending = pending.split("\n")
+        yield from lines
+    yield pending
+
+def strip_lines(lines):
+    """Streaming equivalent of "\n".join(lines).strip(): leading and trailing blank lines are dropped."""
+    last = None
+    blanks = []
+    for line in lines:
+        if last is None:
+            if line.strip():
+                last = line.lstrip()
+            continue
+        if not line.strip():
+            blanks.append(line)
             continue
+        yield last
+        yield from blanks
+        blanks = []
+        last = line
+    if last is not None:
+        yield last.rstrip()
 
-        if status == 'A':
-            changes['added'].append(path)
-        elif status == 'M':
-            changes['modified'].append(path)
-        elif status == 'D':
-            changes['deleted'].append(path)
-    return changes
-
-def generate_documentation_content(context):
-    """Generate documentation using GPT-4o"""
-    response = llm.invoke(context)
-    return response.content
+def clean_generated_lines(lines):
+    """Remove placeholders and markdown fences line by line, so generated content can be cleaned as it streams."""
+    for line in lines:
+        line = re.sub(r"\[.*?describe.*?\]", "", line, flags=re.IGNORECASE)
+        yield line.replace("```markdown", "")
+
+def clean_generated_content(content):
+    """Remove placeholders and markdown fences from generated content but keep code snippets intact."""
+    return "\n".join(clean_generated_lines(content.split("\n"))).strip()
 
-def update_documentation_file(new_content, current_content=None):
+def update_documentation_file(new_content, current_content=None, revision=None):
     """
     Updates the documentation file by updating only the dynamic part and appending a single commit marker.
-    It removes any occurrences of the "Static Content Start" marker and ensures that the "Recent Changes" section
-    does not include duplicates or changes from the documentation file itself.
+    The document is handled as a section tree: the "Recent Changes" section is replaced (or appended) and every
+    section records the source files it mentions, so later runs only regenerate sections whose sources changed.
+    The marker and source paths are those of `revision` when given, otherwise of HEAD and the index.
     """
-    commit_marker = f"Last Documented Commit: {get_current_commit_hash()}"
-
-    # Clean up new_content: remove placeholders but keep code snippets intact.
-    new_content = re.sub(r"\[.*?describe.*?\]", "", new_content, flags=re.IGNORECASE).strip()
-    new_content = new_content.replace("```markdown", "")
+    commit_marker = f"Last Documented Commit: {repo.rev_parse(revision) if revision else get_current_commit_hash()}"
+    new_content = clean_generated_content(new_content)
+    known_paths = [path for path, _ in get_tracked_blobs(revision)]
 
     # If no current content exists, create a new document with only dynamic content.
     if not current_content:
-        return f"{new_content}\n\n{commit_marker}"
+        root = parse_sections(new_content)
+        annotate_sources(root, known_paths)
+        return f"{render_sections(root).strip()}\n\n{commit_marker}"
 
     # Remove "Last Documented Commit" occurrences before reassembling.
     current_content = re.sub(r"Last Documented Commit: [a-f0-9]+", "", current_content).strip()
+    root = parse_sections(current_content)
 
-    # Update the "Recent Changes" section.
-    recent_changes_pattern = r"(## Recent Changes\s*\n)(.*?)(?=\n##|\Z)"
-    match = re.search(recent_changes_pattern, current_content, flags=re.DOTALL)
-
-    new_changes_summary = f"## Recent Changes\n{new_content}\n"
+    # Update the "Recent Changes" section, or append it to the document.
+    recent_changes = find_section(root, "Recent Changes")
+    if recent_changes is None:
+        if root.children or root.body:
+            root.body.append("")
+        recent_changes = parse_sections("## Recent Changes").children[0]
+        root.children.append(recent_changes)
+    recent_changes.children = []
+    set_body(recent_changes, new_content)
 
-    if match:
-        # Replace the existing "Recent Changes" section with the new summary.
-        updated_content = re.sub(recent_changes_pattern, new_changes_summary, current_content, flags=re.DOTALL)
-    else:
-        # Append the recent changes section to the document.
-        updated_content = current_content + "\n\n" + new_changes_summary
+    annotate_sources(root, known_paths)
 
     # Append the single commit marker at the end.
-    updated_content = updated_content.strip() + f"\n\n{commit_marker}"
+    return render_sections(root).strip() + f"\n\n{commit_marker}"
 
-    return updated_content
+def stream_new_documentation(lines, revision=None):
+    """
+    Yield a new documentation file chunk by chunk from generated (already cleaned) lines: the streaming
+    counterpart of update_documentation_file without current content. Each section is annotated as soon as it
+    is complete, so the document never has to be held in memory.
+    """
+    commit_marker = f"Last Documented Commit: {repo.rev_parse(revision) if revision else get_current_commit_hash()}"
+    known_paths = [path for path, _ in get_tracked_blobs(revision)]
+    on_section = lambda section: logging.info(f"Generated section: {section.title}")
+    for line in strip_lines(annotate_stream(lines, known_paths, on_section)):
+        yield line + "\n"
+    yield f"\n{commit_marker}"
 
-def commit_to_documentation_branch():
-    """Handle git operations for documentation branch"""
+def write_documentation_file(documentation_file, content):
+    """
+    Atomically write the documentation: `content` (a string or an iterable of strings, such as a stream) goes to
+    a temporary file next to the target, which is fsynced and renamed into place. A crash or failed stream leaves
+    the previous documentation untouched instead of a truncated file.
+    """
+    if isinstance(content, str):
+        content = [content]
+    directory = os.path.dirname(os.path.abspath(documentation_file))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(documentation_file)}.", suffix=".tmp", dir=directory)
     try:
-        # Create or checkout documentation branch
-        subprocess.run(['git', 'checkout', '-B', DOC_BRANCH], check=True)
-        
-        # Add and commit documentation
-        subprocess.run(['git', 'add', DOCUMENTATION_FILE], check=True)
-        subprocess.run(['git', 'commit', '-m', f"docs: Auto-update documentation {datetime.now().isoformat()}"], check=True)
-        subprocess.run(['git', 'push', '-f', 'origin', DOC_BRANCH], check=True)
-        return True
-    except subprocess.CalledProcessError as e:
+        with os.fdopen(fd, 'w') as f:
+            for chunk in content:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            mode = stat.S_IMODE(os.stat(documentation_file).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, documentation_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    # Make the rename itself durable (not supported on every platform)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+def regenerate_stale_sections(current_content, changes, last_commit):
+    """
+    Regenerate only the documentation sections whose source files changed since the last documented commit.
+    The stale sections are sent to the LLM concurrently and spliced back into the document.
+    """
+    root = parse_sections(current_content)
+    stale = [(section, dependencies) for section, dependencies in stale_sections(root, changed_paths(changes))
+             if section.title.strip().lower() != "recent changes"]
+    if not stale:
+        return current_content
+
+    symbol_changes, _ = symbol_changes_by_path(repo, last_commit, changes)
+    statuses = {path: status for status in ('added', 'modified', 'deleted') for path in changes[status]}
+    for old_path, path in changes['renamed']:
+        statuses[old_path] = f"renamed to {path}"
+        statuses[path] = f"renamed from {old_path}"
+    for old_path, path in changes['copied']:
+        statuses[path] = f"copied from {old_path}"
+    renamed = dict(changes['renamed'])
+    prompts = []
+    for section, dependencies in stale:
+        section_changes = "\n".join(symbol_changes.get(path, f"{path} ({statuses[path]})") for path in dependencies)
+        edited_note = "This section was edited by hand since it was generated; preserve those edits.\n" if section.edited else ""
+        prompts.append(SECTION_PROMPT.format(
+            title=section.title, body=section.text, changes=section_changes, edited_note=edited_note
+        ))
+
+    logging.info(f"Regenerating {len(stale)} stale documentation section(s): {[section.title for section, _ in stale]}")
+    responses = get_llm_client().invoke_many(prompts, kind="section")
+    for (section, dependencies), response in zip(stale, responses):
+        set_body(section, clean_generated_content(response.content))
+        # Keep the dependencies recorded even if the regenerated text no longer names them (renamed files under their new path)
+        sources = set(section.sources) | set(dependencies)
+        sources |= {renamed[path] for path in sources if path in renamed}
+        section.sources = sorted(sources - set(changes['deleted']) - set(renamed))
+    return render_sections(root)
+
+def commit_to_documentation_branch(paths=(DOCUMENTATION_FILE,), push=None):
+    """
+    Commit the documentation files to the documentation branch with git plumbing (see GitRepository.commit_files):
+    the tree of HEAD with the files replaced, parented on the previous documentation commit (local, or fetched from
+    the remote in a fresh clone) and HEAD. The working
+    tree and the index are left alone, so this is safe while other jobs use the same checkout. The branch is
+    pushed unless pushing is disabled (DOC_GEN_PUSH=0, or push=False to push several commits later in one go).
+    """
+    try:
+        files = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                files[path] = f.read()
+        commit = repo.commit_files(DOC_BRANCH, files, f"docs: Auto-update documentation {datetime.now().isoformat()}",
+                                   upstream=repo.tracking_ref(DOC_BRANCH))
+    except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as e:
         logging.error(f"Git operation failed: {e}")
         return False
+    logging.info(f"Committed {list(files)} to {DOC_BRANCH} as {commit[:12]}")
+    if PUSH_ENABLED if push is None else push:
+        return push_documentation_branch()
+    return True
 
-def get_complete_repo_content():
-    """Return a concatenated string of all tracked files (with headers) from the repository."""
+def push_documentation_branch(remote="origin", branch=DOC_BRANCH):
+    """Push the documentation branch, with every documentation commit made since the last push."""
     try:
-        # List all tracked files (this respects .gitignore)
-        file_list = subprocess.check_output(['git', 'ls-files']).decode().splitlines()
+        repo.run('push', remote, f"refs/heads/{branch}:refs/heads/{branch}")
+        return True
     except subprocess.CalledProcessError as e:
-        logging.error(f"Error listing repo files: {e}")
-        return ""
-    
+        logging.error(f"Pushing {branch} to {remote} failed: {e.stderr.strip()}")
+        return False
+
+def iter_repo_sources(revision=None, scope=None):
+    """Yield (path, text) for every documentable tracked file (within `scope`), one file at a time."""
+    if revision is None:
+        file_list = [f for f in list_tracked_files() if scope is None or scope(f)]
+        skipped = get_skipped_files(file_list)
+        for f in file_list:
+            if f in skipped or not os.path.isfile(f):
+                continue
+            chunks = list(iter_file_chunks(f))
+            if chunks:
+                yield f, prepare_text(f, "".join(chunks))
+    else:
+        for path, blob_sha in get_tracked_blobs(revision, scope):
+            content = read_blob(blob_sha, path)
+            if content is not None:
+                yield path, content
+
+def get_complete_repo_content(revision=None, budget=PROMPT_TOKEN_BUDGET, scope=None):
+    """
+    Return a concatenated string of all tracked files (with headers) from the repository.
+    Files are streamed in chunks; binary, oversized and generated/vendored files are skipped.
+    When a revision is given, its files are read from the object database instead of the working tree.
+    If the files do not fit the token budget, the most important ones (README, entry points, widely
+    imported modules) are kept and the dropped files are listed at the end. With compaction, only the most
+    important files are included in full and the rest as skeletons (signatures, docstrings and constants).
+    """
+    if COMPACTION_ENABLED:
+        from compaction import compact_sources
+        return compact_sources(lambda: iter_repo_sources(revision, scope), budget or float("inf"))
+
+    selected = None
+    report = ""
+    if budget:
+        # First pass only counts tokens and ranks files, so the content is never held in memory twice
+        plan = plan_budget(rank_sources(iter_repo_sources(revision, scope)), budget)
+        if plan.dropped:
+            selected = {item["name"] for item in plan.selected}
+            report = f"\n{plan.report()}\n"
+
+    if revision is None:
+        file_list = [f for f in list_tracked_files() if (scope is None or scope(f)) and (selected is None or f in selected)]
+        return "".join(iter_repo_content(file_list)) + report
+
     repo_content = []
-    for f in file_list:
-        if os.path.isfile(f):
-            try:
-                with open(f, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    # Add a header with the file path so the LLM knows which file it is reading
-                    repo_content.append(f"### File: {f}\n```\n{content}\n```\n")
-            except Exception as e:
-                logging.warning(f"Could not read file {f}: {e}")
-    return "\n".join(repo_content)
-
-def main_flow():
-    # Check if documentation already exists
-    current_content = None
-    last_commit = None
+    for path, content in iter_repo_sources(revision, scope):
+        if selected is None or path in selected:
+            repo_content.append(f"### File: {path}\n```\n{content}\n```\n")
+    return "\n".join(repo_content) + report
+
+def get_tracked_blobs(revision=None, scope=None):
+    """
+    Return (path, blob_sha) pairs for every tracked file: from the index (`git ls-files -s`) by default,
+    or from the tree of the given revision. Lockfiles and files that .gitattributes or their name mark as
+    binary, generated or vendored are left out, as are files outside `scope` when one is given.
+    """
+    try:
+        blobs = repo.ls_tree(revision) if revision else repo.ls_files()
+        if scope is not None:
+            blobs = [(path, blob_sha) for path, blob_sha in blobs if scope(path)]
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logging.error(f"Error listing repo blobs: {e}")
+        return []
+    skipped = get_skipped_files([path for path, _ in blobs])
+    return [(path, blob_sha) for path, blob_sha in blobs if path not in skipped]
 
-    if os.path.exists(DOCUMENTATION_FILE):
-        with open(DOCUMENTATION_FILE, 'r') as f:
-            current_content = f.read()
-        # Extract last documented commit hash from existing documentation
-        match = re.search(r"Last Documented Commit: ([a-f0-9]+)", current_content)
-        last_commit = match.group(1) if match else None
+def read_blob(blob_sha, path=None):
+    """
+    Read a blob from the object database as text, or None if it is binary or too large. With the file's
+    path, the text is prepared for prompts (e.g. notebooks are reduced to their cell sources).
+    """
+    data = repo.read_blob(blob_sha, max_bytes=MAX_FILE_BYTES)
+    if data is None or is_binary(data[:8000]):
+        return None
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return prepare_text(path, text) if path else text
 
-    if not current_content:
-        # No documentation exists: use the entire repository content
-        complete_repo = get_complete_repo_content()
+def get_summary_cache():
+    """Return the process-wide summary cache, so long-running processes load its index only once."""
+    global summary_cache
+    if summary_cache is None:
+        from summary_cache import SummaryCache
+        summary_cache = SummaryCache()
+    return summary_cache
+
+def get_retrieval_index():
+    """Return the process-wide retrieval index, loading it from disk on first use."""
+    global retrieval_index
+    if retrieval_index is None:
+        from retrieval_index import RetrievalIndex
+        retrieval_index = RetrievalIndex()
+    return retrieval_index
+
+def get_related_context(changes, symbol_changes, current_content, documentation_file=DOCUMENTATION_FILE,
+                        budget=RETRIEVAL_TOKEN_BUDGET):
+    """
+    Return the code chunks and documentation sections most related to the changes (callers, the sections and README
+    passages mentioning the changed files), ranked by BM25 against the changed paths and symbols and kept within the
+    token budget. Chunks of the changed files themselves are left out; their changes are already in the prompt.
+    The index is brought up to date first, which only reads files whose blob SHA was never indexed.
+    """
+    changed = changed_paths(changes)
+    if not changed:
+        return ""
+    sections = {}
+    for section in iter_sections(parse_sections(current_content)):
+        if section.text and section.title.strip().lower() != "recent changes":
+            key = hashlib.sha1(f"{section.heading}\n{section.text}".encode("utf-8")).hexdigest()
+            sections[f"section:{key}"] = section
+    blobs = [(path, blob_sha) for path, blob_sha in get_tracked_blobs()
+             if posixpath.basename(path) != posixpath.basename(DOCUMENTATION_FILE)]
+    documents = blobs + [(f"{documentation_file}#{section.title}", key) for key, section in sections.items()]
+
+    def read_text(key, path):
+        return sections[key].text if key in sections else read_blob(key, path)
+
+    index = get_retrieval_index()
+    index.update(documents, read_text)
+    index.flush()
+    results = index.search(" ".join(changed) + "\n" + symbol_changes, documents, exclude=changed)
+
+    parts, used = [], 0
+    for path, key, start, end, _ in results:
+        if key in sections:
+            part = f"### {path}\n{sections[key].text}"
+        else:
+            text = "\n".join((read_blob(key, path) or "").split("\n")[start - 1:end])
+            part = f"### {path} (lines {start}-{end})\n```\n{text}\n```"
+        tokens = count_tokens(part)
+        if used + tokens > budget:
+            continue
+        parts.append(part)
+        used += tokens
+    return "\n\n".join(parts)
+
+def summarize_file(path, content):
+    """
+    Summarize a single file. A file too large for one request is split into parts that are summarized separately
+    and merged (see map_reduce.summarize_content), so large files never overflow the model's context.
+    """
+    from map_reduce import summarize_content
+    return summarize_content(path, content, generate_documentation_content, FILE_SUMMARY_PROMPT)
+
+def summary_key(blob_sha):
+    """
+    Return the summary cache key of a blob: its SHA combined with the summary prompt and the models summaries
+    are routed to, so changing the prompt or a model regenerates the summaries instead of reusing stale ones.
+    """
+    from model_router import LARGE_MODEL, SMALL_MODEL, SMALL_MODEL_MAX_TOKENS
+    from map_reduce import FILE_CHUNK_PROMPT, MERGE_PROMPT, MAP_REDUCE_CHUNK_TOKENS
+
+    version = (f"{FILE_SUMMARY_PROMPT}\0{FILE_CHUNK_PROMPT}\0{MERGE_PROMPT}\0{MAP_REDUCE_CHUNK_TOKENS}\0"
+               f"{LARGE_MODEL}\0{SMALL_MODEL}\0{SMALL_MODEL_MAX_TOKENS}")
+    return hashlib.sha1(f"{blob_sha}\0{version}".encode("utf-8")).hexdigest()
+
+def get_repo_summaries(cache=None, revision=None, scope=None, max_workers=SUMMARY_MAX_WORKERS):
+    """
+    Return a concatenated string of per-file summaries (with headers) for all tracked files.
+    Summaries are cached by blob SHA, so only files whose content changed since an earlier run
+    (on any branch) are sent to the LLM, concurrently and once per distinct content.
+    """
+    if cache is None:
+        cache = get_summary_cache()
+    blobs = [(path, blob_sha) for path, blob_sha in get_tracked_blobs(revision, scope) if in_scope(path, scope)]
+    summaries, missing = {}, {}
+    for path, blob_sha in blobs:
+        summary = cache.get(summary_key(blob_sha))
+        if summary is None:
+            missing.setdefault(blob_sha, path)
+        else:
+            summaries[blob_sha] = summary
+
+    def summarize(item):
+        blob_sha, path = item
+        content = read_blob(blob_sha, path)
+        if content is None:
+            logging.warning(f"Skipping binary file {path}")
+            return blob_sha, None
+        summary = summarize_file(path, content)
+        cache.put(summary_key(blob_sha), summary)
+        return blob_sha, summary
+
+    try:
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for blob_sha, summary in executor.map(summarize, missing.items()):
+                    if summary is not None:
+                        summaries[blob_sha] = summary
+    finally:
+        cache.flush()
+    logging.info(f"Summary cache: {cache.hits} hits, {cache.misses} misses")
+    summaries = [{"name": path, "text": f"### File: {path}\n{summaries[blob_sha]}\n",
+                  "tokens": count_tokens(summaries[blob_sha]), "score": score_file(path)}
+                 for path, blob_sha in blobs if blob_sha in summaries]
+    plan = plan_budget(summaries, PROMPT_TOKEN_BUDGET)
+    return "\n".join(item["text"] for item in plan.selected) + (f"\n{plan.report()}\n" if plan.dropped else "")
+
+def get_symbol_changes(last_commit, changes, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Return the compact changed-symbol list for the Python files in a structured diff, keeping the files
+    with the largest changes when the list does not fit the token budget.
+    """
+    summaries, _ = symbol_changes_by_path(repo, last_commit, changes)
+    candidates = [{"name": path, "text": text, "tokens": count_tokens(text),
+                   "score": score_file(path, changed_lines=text.count("\n"))}
+                  for path, text in summaries.items()]
+    plan = plan_budget(candidates, budget)
+    return "\n".join(item["text"] for item in plan.selected) + (f"\n{plan.report()}" if plan.dropped else "")
+
+def get_hierarchical_summaries(cache=None, revision=None, scope=None):
+    """
+    Return hierarchical (map-reduce) summaries of the repository: files are summarized in parallel,
+    merged into directory summaries level by level, and the top-level summaries are returned.
+    """
+    from map_reduce import summarize_repository
+
+    if cache is None:
+        cache = get_summary_cache()
+    blobs = [(path, blob_sha) for path, blob_sha in get_tracked_blobs(revision, scope) if in_scope(path, scope)]
+    summaries = summarize_repository(blobs, read_blob, generate_documentation_content, FILE_SUMMARY_PROMPT, cache,
+                                     cache_key=summary_key)
+    logging.info(f"Summary cache: {cache.hits} hits, {cache.misses} misses")
+    return summaries
+
+def read_documentation(documentation_file=DOCUMENTATION_FILE):
+    """Return the existing documentation and its last documented commit ((None, None) if there is none)."""
+    if not os.path.exists(documentation_file):
+        return None, None
+    with open(documentation_file, 'r') as f:
+        current_content = f.read()
+    # Extract last documented commit hash from existing documentation
+    match = re.search(r"Last Documented Commit: ([a-f0-9]+)", current_content)
+    return current_content, match.group(1) if match else None
+
+def build_initial_prompt(revision=None, scope=None, subject="this project"):
+    """
+    Build the prompt for documentation written from scratch: the entire repository content, or cached per-file
+    summaries of it. With a revision, its files are read from the object database instead of the working tree.
+    """
+    with metrics.span("ingest"):
+        if MAP_REDUCE_ENABLED:
+            complete_repo = get_hierarchical_summaries(revision=revision, scope=scope)
+            repo_description = "the hierarchical summaries of the code base provided below (files merged into directory summaries)"
+        elif SUMMARY_CACHE_ENABLED:
+            complete_repo = get_repo_summaries(revision=revision, scope=scope)
+            repo_description = "per-file summaries of the complete code base provided below (which include file paths)"
+        else:
+            complete_repo = get_complete_repo_content(revision=revision, scope=scope)
+            if COMPACTION_ENABLED:
+                repo_description = ("the code base provided below (file paths, the full contents of the most important files "
+                                    "and the signatures and docstrings of the others)")
+            else:
+                repo_description = "the complete code base provided below (which includes file paths and contents)"
+    with metrics.span("prompt_build"):
         prompt = f"""You are an expert developer and technical writer.
-Using the complete code base provided below (which includes file paths and contents), generate detailed documentation that is specific to this project.
+Using {repo_description}, generate detailed documentation that is specific to {subject}.
 Include:
 - A clear overview of the project's purpose, features, and goals.
 - A breakdown of the file structure (listing each file and its role).
@@ -168,56 +641,140 @@ The complete repository content is provided below:
 Ensure the documentation is specific to the code, and do not include generic or templated sections.
 Format the output in Markdown with clear section headers.
 """
-        print(prompt)
+    metrics.log_prompt("Initial documentation", prompt)
+    return prompt
+
+def document_revision(revision, scope=None, subject="this project"):
+    """
+    Return new documentation for a revision, generated from its tree in the object database (nothing is
+    checked out or written), with that revision as the last documented commit.
+    """
+    prompt = build_initial_prompt(revision, scope, subject)
+    with metrics.span("llm", revision=revision):
+        return "".join(stream_new_documentation(stream_documentation_content(prompt, kind="initial"), revision))
+
+def main_flow(documentation_file=DOCUMENTATION_FILE, scope=None, subject="this project", commit=True, push=None):
+    """
+    Generate or update the documentation. By default the whole repository is documented in DOCUMENTATION_FILE
+    and committed to the documentation branch; `scope` and `documentation_file` document only part of the
+    repository (see doc_gen_shards.py), and `commit=False` leaves committing to the caller. `push` overrides
+    DOC_GEN_PUSH for this run.
+    """
+    # Check if documentation already exists
+    current_content, last_commit = read_documentation(documentation_file)
+
+    # Fast path: nothing to document, so no model client, LLM call or documentation commit
+    if current_content and last_commit:
+        with metrics.span("change_check"):
+            changed = has_source_changes(last_commit, scope)
+        if not changed:
+            logging.info(f"No changes since the last documented commit {last_commit[:12]}; nothing to do")
+            return True
+
+    if not current_content:
+        # No documentation exists: use the entire repository content, or cached per-file summaries of it
+        prompt = build_initial_prompt(scope=scope, subject=subject)
     else:
         # Documentation exists: only pass the diff (added, modified, deleted files)
-        changes = get_structured_diff(last_commit)
-        context = {
-            "existing_content": current_content,
-            "changes": changes,
-            "files_changed": {
-                "added": [f for f in changes['added'] if os.path.isfile(f)],
-                "modified": [f for f in changes['modified'] if os.path.isfile(f)],
-                "deleted": changes['deleted']
+        with metrics.span("git_diff"):
+            changes = get_structured_diff(last_commit, scope)
+        if last_commit and not changed_paths(changes):
+            # Only generated files or whitespace changed: record the new commit without asking the model
+            logging.info("Only generated files or whitespace changed; moving the documented commit")
+            marker = f"Last Documented Commit: {get_current_commit_hash()}"
+            content, replaced = re.subn(r"Last Documented Commit: [a-f0-9]+", marker, current_content)
+            if not replaced:
+                content = f"{content.rstrip()}\n\n{marker}"
+            write_documentation_file(documentation_file, content)
+            return commit_to_documentation_branch((documentation_file,), push) if commit else True
+        with metrics.span("git_diff"):
+            # Compact list of changed functions/classes instead of raw diffs or whole files
+            symbol_changes = get_symbol_changes(last_commit, changes)
+        # Only the most related passages of the rest of the repository and documentation, not everything
+        related_context = ""
+        if RETRIEVAL_ENABLED:
+            with metrics.span("retrieval"):
+                related_context = get_related_context(changes, symbol_changes, current_content, documentation_file)
+        # Only the sections that depend on changed files are regenerated; the rest of the document is not re-sent
+        if SECTION_UPDATES_ENABLED:
+            with metrics.span("section_regeneration"):
+                current_content = regenerate_stale_sections(current_content, changes, last_commit)
+        with metrics.span("prompt_build"):
+            context = {
+                "changes": changes,
+                "symbol_changes": symbol_changes,
+                "related_context": related_context,
+                "files_changed": {
+                    "added": [f for f in changes['added'] if os.path.isfile(f)],
+                    "modified": [f for f in changes['modified'] if os.path.isfile(f)],
+                    "deleted": changes['deleted'],
+                    "renamed": changes['renamed'],
+                    "copied": changes['copied']
+                }
             }
-        }
-        prompt = f"""You are an expert developer and technical writer.
+            prompt = f"""You are an expert developer and technical writer.
 The project documentation already exists. However, there have been changes since the last documented commit.
 The changes are as follows:
 - Added files: {changes['added']}
 - Modified files: {changes['modified']}
 - Deleted files: {changes['deleted']}
+- Renamed files: {[f"{old} -> {new}" for old, new in changes['renamed']]}
+- Copied files: {[f"{old} -> {new}" for old, new in changes['copied']]}
+
+Changed functions, classes and signatures in Python files and notebooks (+ added, - removed, ~ modified):
+{symbol_changes or 'None'}
+
+Related code and documentation that did not change (for reference, to explain how the changes fit in):
+{related_context or 'None'}
 
 Using this context, update the documentation to accurately reflect these changes.
 ### **Important Instructions:**
 - Provide **a detailed summary** of each modified file, explaining what was changed (and why if you can, if not then dont make it up).
 - For **added files**, describe their purpose and how they fit into the project.
 - For **deleted files**, note if their functionality was removed or replaced.
+- For **renamed files**, refer to them by their new path.
 - Ensure that the **Recent Changes** section is listing changes per file with a **brief explanation**.
 - Do **not** include any generic placeholder text or markdown wrappers like '```markdown'.
 - Only update the **dynamic sections** (such as the Overview and Recent Changes).
 - Do **not** modify or include static sections (like Usage, Contributing, License, Contact).
 - Output the updated content in **Markdown format** with clear section headers.
 """
-        print(context)
-        print(prompt)
-    
-    # Generate documentation content using the LLM (assume generate_documentation_content calls the GPT API)
-    new_content = generate_documentation_content(prompt)
+        metrics.log_prompt("Update context", str(context))
+        metrics.log_prompt("Update", prompt)
     
-    # Update the documentation file by appending the new commit marker
-    updated_content = update_documentation_file(new_content, current_content)
-    
-    # Write the updated documentation to file
-    with open(DOCUMENTATION_FILE, 'w') as f:
-        f.write(updated_content)
+    # Generate documentation content using the LLM, consuming (and cleaning) tokens as they arrive
+    if not current_content and STREAMING_ENABLED:
+        # New documentation is annotated and written section by section while the response streams in
+        with metrics.span("llm", streaming=True):
+            write_documentation_file(documentation_file, stream_new_documentation(stream_documentation_content(prompt, kind="initial")))
+    else:
+        with metrics.span("llm"):
+            new_content = "\n".join(stream_documentation_content(prompt, kind="update" if current_content else "initial"))
+
+        # Update the documentation file by appending the new commit marker
+        with metrics.span("update_documentation"):
+            updated_content = update_documentation_file(new_content, current_content)
+
+        # Write the updated documentation to file
+        with metrics.span("write_documentation"):
+            write_documentation_file(documentation_file, updated_content)
+    if not commit:
+        return True
     
     # Commit changes to the documentation branch
-    if commit_to_documentation_branch():
+    with metrics.span("git_commit"):
+        committed = commit_to_documentation_branch((documentation_file,), push)
+    if committed:
         logging.info("Documentation updated successfully")
     else:
         logging.error("Failed to update documentation")
+    return committed
 
 
 if __name__ == "__main__":
-    main_flow()
\ No newline at end of file
+    if metrics.METRICS_PORT:
+        metrics.serve_metrics()
+    try:
+        main_flow()
+    finally:
+        metrics.flush()
\ No newline at end of file
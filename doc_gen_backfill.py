@@ -0,0 +1,148 @@
+"""
+Historical backfill: documentation snapshots for past revisions, e.g. every release tag.
+
+    python doc_gen_backfill.py --tags                    # every tag, oldest first
+    python doc_gen_backfill.py --range v1.0..v2.0        # every first-parent commit in a range
+    python doc_gen_backfill.py v1.0 v1.1 v2.0 --workers 8
+
+Each revision is documented from its own tree in the object database, so nothing is checked out and
+the working tree may be in any state. Files shared between revisions are summarized once: every
+distinct blob is summarized up front (in parallel, through the blob-SHA summary cache), after which
+each revision costs one generation request. Revisions are generated in parallel and their
+documentation is committed to the documentation branch in revision order.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import doc_gen
+import metrics
+
+# Configurations
+# Revisions (and blob summaries) generated at the same time; all requests share one rate-limited client
+BACKFILL_WORKERS = int(os.getenv("DOC_GEN_BACKFILL_WORKERS", 8))
+
+
+def list_revisions(revisions=(), revision_range=None, tags=False):
+    """Return (name, commit SHA) pairs to document, oldest first, without duplicate commits."""
+    names = list(revisions)
+    if tags:
+        names += doc_gen.repo.run('for-each-ref', '--sort=creatordate', '--format=%(refname:short)', 'refs/tags').split()
+    if revision_range:
+        names += doc_gen.repo.run('rev-list', '--reverse', '--first-parent', revision_range).split()
+    selected, seen = [], set()
+    for name in names:
+        sha = doc_gen.repo.rev_parse(f"{name}^{{commit}}")
+        if sha not in seen:
+            seen.add(sha)
+            selected.append((name, sha))
+    return selected
+
+
+def warm_summaries(revisions, max_workers=BACKFILL_WORKERS):
+    """
+    Summarize every distinct file blob of the revisions that is not cached yet, each exactly once and in
+    parallel, so documenting the revisions afterwards only reads summaries from the cache.
+    Returns the number of blobs summarized.
+    """
+    cache = doc_gen.get_summary_cache()
+    blobs = {}
+    for _, sha in revisions:
+        for path, blob_sha in doc_gen.get_tracked_blobs(sha):
+            if doc_gen.in_scope(path) and doc_gen.summary_key(blob_sha) not in cache:
+                blobs.setdefault(blob_sha, path)
+    logging.info(f"{len(blobs)} distinct file(s) to summarize for {len(revisions)} revision(s)")
+
+    def summarize(item):
+        blob_sha, path = item
+        content = doc_gen.read_blob(blob_sha, path)
+        if content is not None:
+            cache.put(doc_gen.summary_key(blob_sha), doc_gen.summarize_file(path, content))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(summarize, blobs.items()))
+    finally:
+        cache.flush()
+    return len(blobs)
+
+
+def run_backfill(revisions, max_workers=BACKFILL_WORKERS, branch=doc_gen.DOC_BRANCH, push=None):
+    """
+    Document each (name, commit SHA) revision and commit the results to `branch` in order. A revision
+    that fails is reported and left out; the ones after it are still committed. Returns a summary.
+    """
+    start = time.perf_counter()
+    results = [{"revision": name, "commit": sha} for name, sha in revisions]
+    summarized = 0
+    # With map-reduce, summarize_repository() reuses and parallelizes the per-file work itself
+    if doc_gen.SUMMARY_CACHE_ENABLED and not doc_gen.MAP_REDUCE_ENABLED:
+        with metrics.span("backfill_summaries", revisions=len(revisions)):
+            summarized = warm_summaries(revisions, max_workers)
+
+    upstream = doc_gen.repo.tracking_ref(branch)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(doc_gen.document_revision, sha) for _, sha in revisions]
+        # Generated in parallel, committed strictly in revision order
+        for result, future in zip(results, futures):
+            try:
+                content = future.result()
+                with metrics.span("git_commit", revision=result["revision"]):
+                    documentation_commit = doc_gen.repo.commit_files(
+                        branch, {doc_gen.DOCUMENTATION_FILE: content.encode("utf-8")},
+                        f"docs: Documentation for {result['revision']} ({result['commit'][:12]})",
+                        base=result["commit"], upstream=upstream)
+                result.update(status="committed", documentation_commit=documentation_commit)
+                logging.info(f"{result['revision']}: committed as {documentation_commit[:12]}")
+            except Exception as e:
+                logging.exception(f"Documentation of {result['revision']} failed")
+                result.update(status="failed", error=str(e))
+
+    committed = any(result["status"] == "committed" for result in results)
+    if committed and (doc_gen.PUSH_ENABLED if push is None else push):
+        # One push for the whole backfill
+        doc_gen.push_documentation_branch(branch=branch)
+    return {
+        "revisions": results,
+        "summarized_blobs": summarized,
+        "duration_s": round(time.perf_counter() - start, 3),
+        "llm": doc_gen.get_llm_client().stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate documentation for past revisions")
+    parser.add_argument("revisions", nargs="*", help="Commits or tags to document, in order")
+    parser.add_argument("--range", dest="revision_range", help="Document every first-parent commit in A..B")
+    parser.add_argument("--tags", action="store_true", help="Document every tag, oldest first")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="Revisions generated at the same time")
+    parser.add_argument("--branch", default=doc_gen.DOC_BRANCH, help="Branch the documentation is committed to")
+    parser.add_argument("--no-push", dest="push", action="store_false", default=None, help="Only commit locally")
+    parser.add_argument("--output", help="Where to write a JSON summary")
+    args = parser.parse_args(argv)
+
+    try:
+        revisions = list_revisions(args.revisions, args.revision_range, args.tags)
+    except (ValueError, subprocess.CalledProcessError) as e:
+        parser.error(f"cannot resolve the revisions: {e}")
+    if not revisions:
+        parser.error("no revisions given (pass revisions, --range or --tags)")
+    summary = run_backfill(revisions, args.workers, args.branch, args.push)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    failed = [result["revision"] for result in summary["revisions"] if result["status"] == "failed"]
+    logging.info(f"Documented {len(revisions) - len(failed)} of {len(revisions)} revision(s) in {summary['duration_s']}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        metrics.flush()
@@ -0,0 +1,154 @@
+"""
+Batch runner: keep the documentation of many repositories up to date in one process tree.
+
+    python doc_gen_batch.py repos.txt --workers 8 --output doc_gen_batch.json
+
+The manifest lists one repository path per line (blank lines and `#` comments are ignored). Repositories
+with nothing to document are skipped up front, the rest are processed largest change first by a pool of
+worker processes that share a single rate-limited LLM client and one summary cache, and a JSON summary of
+the results and timings is written at the end.
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+from concurrent.futures import as_completed
+
+import doc_gen
+import metrics
+from git_backend import GitRepository, git_common_path
+from process_pool import SharedProcessPool
+
+# Configurations
+BATCH_WORKERS = int(os.getenv("DOC_GEN_BATCH_WORKERS", min(16, (os.cpu_count() or 1) + 4)))
+# Summaries and model responses are content-addressed, so one cache directory serves every repository
+# (relative paths are resolved against the current directory)
+BATCH_CACHE_DIR = os.getenv("DOC_GEN_CACHE_DIR", ".doc_gen_cache")
+SHORTSTAT_RE = re.compile(r"(\d+) (?:insertion|deletion)")
+
+
+def read_manifest(path):
+    """Return the absolute repository paths listed in a manifest file."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        entries = [line.split("#", 1)[0].strip() for line in f]
+    return [os.path.normpath(os.path.join(base, entry)) for entry in entries if entry]
+
+
+def measure_changes(path):
+    """
+    Return (status, changed_lines) for one repository without loading any model: "new" when it has no
+    documentation yet, "unchanged" when nothing but the documentation changed since the last documented
+    commit, otherwise "changed" with the number of inserted and deleted lines.
+    """
+    _, last_commit = doc_gen.read_documentation(os.path.join(path, doc_gen.DOCUMENTATION_FILE))
+    if last_commit is None:
+        return "new", None
+    repo = GitRepository(path)
+    try:
+        if repo.rev_parse("HEAD") == last_commit:
+            return "unchanged", 0
+        stat = repo.run('diff', '--shortstat', last_commit, 'HEAD', '--', '.', f":(exclude){doc_gen.DOCUMENTATION_FILE}")
+    except (ValueError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Could not compare {path} with its last documented commit: {e}")
+        return "changed", None
+    finally:
+        repo.close()
+    changed_lines = sum(int(count) for count in SHORTSTAT_RE.findall(stat))
+    return ("changed", changed_lines) if stat.strip() else ("unchanged", 0)
+
+
+def priority(entry):
+    """Sort key: undocumented repositories first, then the largest changes (long jobs start early)."""
+    if entry["changed_lines"] is None:
+        return (0, 0)
+    return (1, -entry["changed_lines"])
+
+
+def document_repository(path):
+    """Run the documentation pipeline for one repository (runs in a worker process)."""
+    from retrieval_index import RetrievalIndex
+
+    start = time.perf_counter()
+    os.chdir(path)
+    # Workers run many repositories: per-repository state must not carry over from the previous job
+    doc_gen.repo.close()
+    doc_gen.repo = GitRepository()
+    doc_gen.retrieval_index = RetrievalIndex(git_common_path("doc_gen_cache"))
+    try:
+        ok, error = bool(doc_gen.main_flow()), None
+    except Exception as e:
+        logging.exception(f"Documentation of {path} failed")
+        ok, error = False, str(e)
+    finally:
+        doc_gen.repo.close()
+        metrics.flush()
+    return {"ok": ok, "error": error, "duration_s": round(time.perf_counter() - start, 3)}
+
+
+def run_batch(paths, max_workers=BATCH_WORKERS, cache_dir=BATCH_CACHE_DIR):
+    """Document every repository in `paths` and return a summary of results and timings."""
+    from summary_cache import SummaryCache
+
+    start = time.perf_counter()
+    # Workers change directory, and the current directory need not be a repository
+    cache_dir = os.path.abspath(cache_dir)
+    entries = []
+    for path in paths:
+        if not os.path.isdir(path):
+            entries.append({"path": path, "status": "failed", "changed_lines": None, "error": "not a directory"})
+            continue
+        status, changed_lines = measure_changes(path)
+        entries.append({"path": path, "status": status, "changed_lines": changed_lines})
+    pending = sorted((entry for entry in entries if entry["status"] in ("new", "changed")), key=priority)
+    logging.info(f"{len(pending)} of {len(entries)} repositories need documentation")
+
+    cache = SummaryCache(cache_dir)
+    client = doc_gen.get_llm_client(cache_dir) if pending else None
+    if pending:
+        with SharedProcessPool(min(max_workers, len(pending)), client, cache) as pool:
+            # Submitted in priority order; the pool starts them in that order
+            futures = {pool.submit(document_repository, entry["path"]): entry for entry in pending}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    entry.update(future.result())
+                except Exception as e:
+                    entry.update(ok=False, error=str(e))
+                entry["status"] = "updated" if entry.pop("ok") else "failed"
+                logging.info(f"{entry['path']}: {entry['status']} in {entry.get('duration_s', 0)}s")
+        cache.flush()
+
+    counts = {}
+    for entry in entries:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return {
+        "repositories": entries,
+        "counts": counts,
+        "duration_s": round(time.perf_counter() - start, 3),
+        "llm": client.stats if client is not None else {},
+        "summary_cache": {"hits": cache.hits, "misses": cache.misses},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the documentation of many repositories")
+    parser.add_argument("manifest", help="File listing one repository path per line")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Repositories processed at the same time")
+    parser.add_argument("--cache-dir", default=BATCH_CACHE_DIR, help="Summary cache shared by all repositories")
+    parser.add_argument("--output", default="doc_gen_batch.json", help="Where to write the JSON summary")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(read_manifest(args.manifest), args.workers, args.cache_dir)
+    with open(args.output, 'w') as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Done in {summary['duration_s']}s: {summary['counts']} (summary written to {args.output})")
+    return 1 if summary["counts"].get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""
+Long-running watch mode for doc_gen.py.
+
+Instead of starting a new process (importing LangChain, building the model client, spawning git
+processes) for every commit, the daemon stays up, watches the branch ref for new commits, waits
+for bursts of commits to settle and then runs a single documentation update for all of them.
+The model client, summary cache and git backend stay warm between updates.
+
+    python doc_gen_daemon.py --branch main    # watch a branch (default: the current branch)
+    python doc_gen_daemon.py status           # query a running daemon
+    python doc_gen_daemon.py update           # trigger an update now (skips the debounce delay)
+    python doc_gen_daemon.py stop
+
+The daemon checks out the watched commits (detached) in its working tree, so run it in a dedicated
+worktree of the repository (`git worktree add --detach ../docs-worker`) rather than in the checkout you
+are editing. Refs are shared between worktrees, so commits made in your checkout are picked up directly.
+Documentation commits are made with git plumbing and pushed together, at most every
+DOC_GEN_PUSH_INTERVAL_SECONDS.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+import socketserver
+
+import metrics
+from git_backend import git_common_path
+
+# Configurations
+POLL_INTERVAL = float(os.getenv("DOC_GEN_POLL_INTERVAL", 2.0))
+DEBOUNCE_SECONDS = float(os.getenv("DOC_GEN_DEBOUNCE_SECONDS", 10.0))
+# Upper bound on how long a continuous stream of commits can postpone an update
+DEBOUNCE_MAX_SECONDS = float(os.getenv("DOC_GEN_DEBOUNCE_MAX_SECONDS", 120.0))
+# Documentation commits made in between are pushed together (0: push after every update)
+PUSH_INTERVAL = float(os.getenv("DOC_GEN_PUSH_INTERVAL_SECONDS", 300.0))
+# Defaults to doc_gen.sock inside the git directory
+CONTROL_SOCKET = os.getenv("DOC_GEN_CONTROL_SOCKET")
+
+
+def _git(*args, strip=True):
+    output = subprocess.run(['git', *args], check=True, capture_output=True, text=True).stdout
+    return output.strip() if strip else output
+
+
+class RefWatcher:
+    """
+    Detects new commits on a branch. The loose ref file and packed-refs are stat'ed on every poll and
+    the ref is only resolved with git when one of them changed, so idle polling costs no processes.
+    """
+
+    def __init__(self, branch):
+        self.branch = branch
+        git_dir = _git('rev-parse', '--git-common-dir')
+        self.paths = [os.path.join(git_dir, "refs", "heads", *branch.split("/")), os.path.join(git_dir, "packed-refs")]
+        self._stamp = None
+        self.sha = None
+
+    def _stat(self):
+        stamp = []
+        for path in self.paths:
+            try:
+                info = os.stat(path)
+                stamp.append((info.st_mtime_ns, info.st_size, info.st_ino))
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def poll(self):
+        """Return the branch's commit SHA if it moved since the last poll, otherwise None."""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            sha = _git('rev-parse', '--verify', '--quiet', f"refs/heads/{self.branch}")
+        except subprocess.CalledProcessError:
+            return None
+        if sha == self.sha:
+            return None
+        self.sha = sha
+        return sha
+
+
+class DocGenDaemon:
+    """Watches a branch, debounces commits and runs `doc_gen.main_flow()` with warm state."""
+
+    def __init__(self, branch, poll_interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS,
+                 debounce_max=DEBOUNCE_MAX_SECONDS, push_interval=PUSH_INTERVAL):
+        self.branch = branch
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.debounce_max = debounce_max
+        self.push_interval = push_interval
+        self.watcher = RefWatcher(branch)
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._force = False
+        self._first_pending = None
+        self._last_change = None
+        self._last_push = time.monotonic()
+        self.state = {
+            "branch": branch, "pid": os.getpid(), "started": time.time(), "head": None, "pending": False,
+            "running": False, "updates": 0, "commits_seen": 0, "last_documented": None,
+            "last_update": None, "last_error": None, "unpushed": 0,
+        }
+        # Load doc_gen (LangChain, model client, git processes) once for the lifetime of the daemon
+        import doc_gen
+        self.doc_gen = doc_gen
+        doc_gen.get_llm_client()
+        match = re.search(r"Last Documented Commit: ([a-f0-9]+)", self._documented_content() or "")
+        self.state["last_documented"] = match.group(1) if match else None
+
+    def status(self):
+        with self._lock:
+            return dict(self.state)
+
+    def trigger(self):
+        """Request an update as soon as possible, skipping the debounce delay."""
+        with self._lock:
+            self._force = True
+            self.state["pending"] = True
+        self.wake.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+
+    def _note_commit(self, sha):
+        now = time.monotonic()
+        with self._lock:
+            if self.state["head"] is not None:
+                self.state["commits_seen"] += 1
+            self.state["head"] = sha
+            if sha != self.state["last_documented"]:
+                self.state["pending"] = True
+                self._first_pending = self._first_pending or now
+                self._last_change = now
+        logging.info(f"{self.branch} is at {sha[:12]}")
+
+    def _due(self):
+        with self._lock:
+            if not self.state["pending"]:
+                return False
+            if self._force:
+                return True
+            now = time.monotonic()
+            return (now - self._last_change >= self.debounce) or (now - self._first_pending >= self.debounce_max)
+
+    def _documented_content(self):
+        """Return the documentation as last committed to the documentation branch, if any."""
+        try:
+            return _git('show', f"{self.doc_gen.DOC_BRANCH}:{self.doc_gen.DOCUMENTATION_FILE}", strip=False)
+        except subprocess.CalledProcessError:
+            return None
+
+    def _restore_documentation(self):
+        """Bring the latest documentation from the documentation branch into the working tree."""
+        content = self._documented_content()
+        if content is not None:
+            self.doc_gen.write_documentation_file(self.doc_gen.DOCUMENTATION_FILE, content)
+
+    def _reset_documentation(self):
+        """
+        Undo the previous update's changes to the documentation file in the working tree, so checking out a commit
+        that changes (or starts tracking) the file does not fail. The latest documentation is restored afterwards.
+        """
+        path = self.doc_gen.DOCUMENTATION_FILE
+        try:
+            _git('checkout', '-q', 'HEAD', '--', path)
+        except subprocess.CalledProcessError:
+            # Not tracked in the current commit
+            if os.path.exists(path):
+                os.remove(path)
+
+    def run_update(self):
+        """Run one documentation update for everything committed since the last one."""
+        with self._lock:
+            sha = self.state["head"] or self.watcher.sha
+            self.state.update(pending=False, running=True)
+            self._force = False
+            self._first_pending = self._last_change = None
+        start = time.time()
+        ok = committed = False
+        error = None
+        try:
+            self._reset_documentation()
+            # Detached, so the branch can stay checked out in the worktree where commits are made
+            _git('checkout', '-q', '--detach', sha)
+            self._restore_documentation()
+            self.doc_gen.repo.clear_cache()
+            tip = self.doc_gen.repo.branch_tip(self.doc_gen.DOC_BRANCH)
+            with metrics.span("daemon_update", commit=sha):
+                ok = bool(self.doc_gen.main_flow(push=False))
+            # Runs with nothing to document succeed without a commit
+            committed = ok and self.doc_gen.repo.branch_tip(self.doc_gen.DOC_BRANCH) != tip
+        except Exception as e:
+            logging.exception("Documentation update failed")
+            error = str(e)
+        finally:
+            metrics.flush()
+        with self._lock:
+            self.state["running"] = False
+            self.state["last_update"] = {"commit": sha, "started": start, "duration_s": round(time.time() - start, 3),
+                                         "ok": ok}
+            if ok:
+                self.state["updates"] += 1
+                self.state["unpushed"] += int(committed)
+                self.state["last_documented"] = sha
+                self.state["last_error"] = None
+            else:
+                self.state["last_error"] = error or "documentation commit failed"
+        return ok
+
+    def push(self, force=False):
+        """Push the documentation commits made since the last push, if the push interval has elapsed (or `force`)."""
+        with self._lock:
+            unpushed = self.state["unpushed"]
+        if not unpushed or not self.doc_gen.PUSH_ENABLED:
+            return
+        if not force and time.monotonic() - self._last_push < self.push_interval:
+            return
+        self._last_push = time.monotonic()
+        with metrics.span("git_push", commits=unpushed):
+            pushed = self.doc_gen.push_documentation_branch()
+        if pushed:
+            with self._lock:
+                self.state["unpushed"] -= unpushed
+            logging.info(f"Pushed {unpushed} documentation update(s)")
+
+    def serve_forever(self):
+        logging.info(f"Watching {self.branch} (poll {self.poll_interval}s, debounce {self.debounce}s)")
+        while not self.stopping.is_set():
+            sha = self.watcher.poll()
+            if sha:
+                self._note_commit(sha)
+            if self._due():
+                self.run_update()
+            self.push()
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+        self.push(force=True)
+        logging.info("Daemon stopped")
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Local control socket: one JSON line per command (status, update, stop) and one JSON line back."""
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.doc_daemon = daemon
+        super().__init__(path, ControlHandler)
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode("utf-8").strip()
+        daemon = self.server.doc_daemon
+        if command == "status":
+            reply = daemon.status()
+        elif command == "update":
+            daemon.trigger()
+            reply = {"ok": True, "message": "update scheduled"}
+        elif command == "stop":
+            daemon.stop()
+            reply = {"ok": True, "message": "stopping"}
+        else:
+            reply = {"ok": False, "message": f"unknown command {command!r}"}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+def control_socket_path():
+    return CONTROL_SOCKET or git_common_path("doc_gen.sock")
+
+
+def send_command(command, path=None, timeout=10.0):
+    """Send a command to a running daemon and return its decoded reply."""
+    path = path or control_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(f"{command}\n".encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = client.recv(65536)
+            if not data:
+                break
+            reply += data
+    return json.loads(reply)
+
+
+def run_daemon(branch=None, socket_path=None):
+    branch = branch or _git('rev-parse', '--abbrev-ref', 'HEAD')
+    if branch == "HEAD":
+        logging.error("HEAD is detached; pass the branch to watch with --branch")
+        return 1
+    socket_path = socket_path or control_socket_path()
+    if os.path.exists(socket_path):
+        try:
+            send_command("status", socket_path, timeout=1.0)
+            logging.error(f"A daemon is already listening on {socket_path}")
+            return 1
+        except OSError:
+            # Left over from a daemon that did not shut down cleanly
+            os.remove(socket_path)
+
+    daemon = DocGenDaemon(branch)
+    server = ControlServer(socket_path, daemon)
+    threading.Thread(target=server.serve_forever, name="doc-gen-control", daemon=True).start()
+    if metrics.METRICS_PORT:
+        metrics.serve_metrics()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
+        daemon.doc_gen.repo.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep documentation up to date as commits arrive")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "status", "update", "stop"])
+    parser.add_argument("--branch", help="Branch to watch (default: the current branch)")
+    parser.add_argument("--socket", help="Path of the control socket (default: doc_gen.sock in the git directory)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        return run_daemon(args.branch, args.socket)
+    try:
+        print(json.dumps(send_command(args.command, args.socket), indent=2))
+    except OSError as e:
+        logging.error(f"Could not reach the daemon at {args.socket or control_socket_path()}: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Sharded documentation for monorepos.
+
+Every package gets its own documentation file (`<package>/documentation.md`) with its own
+`Last Documented Commit` marker. Only packages touched since their marker are regenerated, in
+parallel on a process pool that shares one rate-limited LLM client, and a top-level index linking
+all package documentation is written to `documentation.md`:
+
+    python doc_gen_shards.py
+    DOC_GEN_SHARD_ROOTS=services/api,services/web,libs/common python doc_gen_shards.py
+
+Package roots are taken from DOC_GEN_SHARD_ROOTS, or detected from package manifests (pyproject.toml,
+package.json, ...); without any manifest, every top-level directory is a package.
+"""
+import os
+import re
+import logging
+import posixpath
+from concurrent.futures import as_completed
+
+import doc_gen
+import metrics
+from process_pool import SharedProcessPool
+
+# Configurations
+SHARD_ROOTS = [root.strip().strip("/") for root in os.getenv("DOC_GEN_SHARD_ROOTS", "").split(",") if root.strip()]
+# Workers spend most of their time waiting for the model, so use more of them than there are cores
+SHARD_WORKERS = int(os.getenv("DOC_GEN_SHARD_WORKERS", min(8, (os.cpu_count() or 1) + 4)))
+PACKAGE_MANIFESTS = {
+    "pyproject.toml", "setup.py", "setup.cfg", "package.json", "Cargo.toml", "go.mod", "pom.xml", "build.gradle",
+}
+
+
+def detect_shard_roots(paths):
+    """Return the directories holding a package manifest, or the top-level directories if there are none."""
+    roots = {posixpath.dirname(path) for path in paths if posixpath.basename(path) in PACKAGE_MANIFESTS}
+    roots.discard("")
+    if not roots:
+        roots = {path.split("/", 1)[0] for path in paths if "/" in path}
+    return sorted(roots)
+
+
+def shard_of(path, roots):
+    """Return the innermost shard root containing `path`, or None for files outside every shard."""
+    best = None
+    for root in roots:
+        if path.startswith(root + "/") and (best is None or len(root) > len(best)):
+            best = root
+    return best
+
+
+def shard_documentation_file(root):
+    return posixpath.join(root, doc_gen.DOCUMENTATION_FILE)
+
+
+class ShardScope:
+    """Path predicate selecting the source files of one shard (nested shards and documentation excluded)."""
+
+    def __init__(self, root, roots):
+        self.root = root
+        self.roots = roots
+        self.documentation_file = shard_documentation_file(root)
+
+    def __call__(self, path):
+        return path != self.documentation_file and shard_of(path, self.roots) == self.root
+
+
+def touched_shards(roots, last_commits):
+    """
+    Return the shards that need regenerating: those without documentation and those with files changed
+    since their own last documented commit. Shards sharing a last commit share one diff.
+    """
+    touched = {root for root in roots if last_commits[root] is None}
+    by_commit = {}
+    for root in roots:
+        if last_commits[root] is not None:
+            by_commit.setdefault(last_commits[root], []).append(root)
+    for last_commit, group in by_commit.items():
+        if doc_gen.get_current_commit_hash() == last_commit:
+            continue
+        changed_paths = doc_gen.changed_paths(doc_gen.get_structured_diff(last_commit))
+        for root in group:
+            scope = ShardScope(root, roots)
+            if any(scope(path) for path in changed_paths):
+                touched.add(root)
+    return [root for root in roots if root in touched]
+
+
+def generate_shard(root, roots):
+    """Generate or update the documentation of one shard (runs in a worker process)."""
+    try:
+        return doc_gen.main_flow(shard_documentation_file(root), ShardScope(root, roots),
+                                 subject=f"the `{root}` package of this repository", commit=False)
+    finally:
+        metrics.flush()
+
+
+def overview_paragraph(content):
+    """Return the first paragraph of prose in a documentation file, for the index."""
+    paragraph = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("#", "<!--", "Last Documented Commit:", "```", "|", "-", "*")):
+            if paragraph:
+                break
+            continue
+        paragraph.append(stripped)
+    return " ".join(paragraph)
+
+
+def build_index(roots, head_commit):
+    """Stitch the top-level index linking every shard's documentation."""
+    lines = ["# Documentation Index", "", "Each package of this repository is documented separately:", ""]
+    for root in roots:
+        content, last_commit = doc_gen.read_documentation(shard_documentation_file(root))
+        if content is None:
+            continue
+        lines.append(f"## [{root}]({shard_documentation_file(root)})")
+        overview = overview_paragraph(re.sub(r"<!--.*?-->", "", content))
+        if overview:
+            lines.append(overview)
+        lines.append(f"_Documented at commit {last_commit[:12] if last_commit else 'unknown'}._")
+        lines.append("")
+    lines.append(f"Last Documented Commit: {head_commit}")
+    return "\n".join(lines) + "\n"
+
+
+def run_sharded(roots=None, max_workers=SHARD_WORKERS, commit=True):
+    """Regenerate the touched shards in parallel, rebuild the index and commit everything. Returns success."""
+    paths = [path for path, _ in doc_gen.get_tracked_blobs()]
+    roots = roots or SHARD_ROOTS or detect_shard_roots(paths)
+    if not roots:
+        logging.error("No package roots configured or detected")
+        return False
+
+    with metrics.span("change_check", shards=len(roots)):
+        last_commits = {root: doc_gen.read_documentation(shard_documentation_file(root))[1] for root in roots}
+        touched = touched_shards(roots, last_commits)
+    if not touched:
+        logging.info(f"None of the {len(roots)} packages changed since they were last documented; nothing to do")
+        return True
+    logging.info(f"Regenerating {len(touched)} of {len(roots)} package(s): {touched}")
+
+    results = {}
+    with metrics.span("shards", regenerated=len(touched)):
+        if max_workers <= 1 or len(touched) == 1:
+            for root in touched:
+                results[root] = generate_shard(root, roots)
+        else:
+            with SharedProcessPool(min(max_workers, len(touched))) as pool:
+                futures = {pool.submit(generate_shard, root, roots): root for root in touched}
+                for future in as_completed(futures):
+                    root = futures[future]
+                    try:
+                        results[root] = future.result()
+                    except Exception:
+                        logging.exception(f"Documentation of {root} failed")
+                        results[root] = False
+
+    failed = [root for root, ok in results.items() if not ok]
+    if failed:
+        logging.error(f"Documentation failed for: {failed}")
+
+    with metrics.span("write_documentation"):
+        doc_gen.write_documentation_file(doc_gen.DOCUMENTATION_FILE, build_index(roots, doc_gen.get_current_commit_hash()))
+    if not commit:
+        return not failed
+
+    documentation_files = [doc_gen.DOCUMENTATION_FILE] + [
+        shard_documentation_file(root) for root in roots if os.path.isfile(shard_documentation_file(root))
+    ]
+    with metrics.span("git_commit"):
+        committed = doc_gen.commit_to_documentation_branch(documentation_files)
+    return committed and not failed
+
+
+if __name__ == "__main__":
+    if metrics.METRICS_PORT:
+        metrics.serve_metrics()
+    try:
+        run_sharded()
+    finally:
+        metrics.flush()
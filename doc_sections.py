@@ -0,0 +1,161 @@
+import re
+import hashlib
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+# Per-section metadata, stored as an HTML comment right below the heading so it is invisible when rendered
+META_RE = re.compile(r"^<!-- doc-gen: sources=(?P<sources>\S*) hash=(?P<hash>[0-9a-f]*) -->$")
+PATH_TOKEN_RE = re.compile(r"[\w./-]+")
+
+
+class Section:
+    """A Markdown section: its heading, own body lines and nested subsections."""
+
+    def __init__(self, title=None, level=0, heading=None):
+        self.title = title
+        self.level = level
+        self.heading = heading
+        self.body = []
+        self.children = []
+        self.sources = []
+        self.stored_hash = None
+
+    @property
+    def text(self):
+        return "\n".join(self.body).strip()
+
+    @property
+    def content_hash(self):
+        return hashlib.sha1(self.text.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def edited(self):
+        """True if the body changed (e.g. by hand) since the hash was last recorded."""
+        return self.stored_hash is not None and self.stored_hash != self.content_hash
+
+
+def parse_sections(text):
+    """Parse a Markdown document into a tree of sections (headings inside code fences are ignored)."""
+    root = Section()
+    stack = [root]
+    in_fence = False
+    for line in text.split("\n"):
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING_RE.match(line)
+        if match:
+            section = Section(match.group(2), len(match.group(1)), line)
+            while stack[-1].level >= section.level:
+                stack.pop()
+            stack[-1].children.append(section)
+            stack.append(section)
+            continue
+        current = stack[-1]
+        meta = META_RE.match(line.strip())
+        if meta and current.heading is not None and not current.body:
+            current.sources = [s for s in meta.group("sources").split(",") if s]
+            current.stored_hash = meta.group("hash")
+            continue
+        current.body.append(line)
+    return root
+
+
+def iter_sections(section):
+    """Yield every section below `section` in document order."""
+    for child in section.children:
+        yield child
+        yield from iter_sections(child)
+
+
+def find_section(root, title):
+    """Return the first section with the given title, or None."""
+    for section in iter_sections(root):
+        if section.title.strip().lower() == title.strip().lower():
+            return section
+    return None
+
+
+def render_sections(section):
+    """Render a section tree back to Markdown, including per-section metadata."""
+    lines = []
+    if section.heading is not None:
+        lines.append(section.heading)
+        if section.sources:
+            lines.append(f"<!-- doc-gen: sources={','.join(section.sources)} hash={section.content_hash} -->")
+    lines.extend(section.body)
+    for child in section.children:
+        lines.append(render_sections(child))
+    return "\n".join(lines)
+
+
+def set_body(section, text):
+    """Replace a section's own body (its subsections are kept), leaving one blank line before the next heading."""
+    section.body = ["", *text.strip().split("\n"), ""] if text.strip() else [""]
+
+
+def mentioned_paths(section, paths):
+    """Return the paths from `paths` that are mentioned in a section's heading or body."""
+    tokens = {token.rstrip(".").removeprefix("./") for token in PATH_TOKEN_RE.findall(f"{section.title}\n{section.text}")}
+    return tokens & set(paths)
+
+
+def annotate_sources(root, known_paths):
+    """
+    Record the source files each section depends on: files whose path is mentioned in the section's
+    heading or body, plus previously recorded files that still exist.
+    """
+    known_paths = set(known_paths)
+    for section in iter_sections(root):
+        section.sources = sorted(mentioned_paths(section, known_paths) | (set(section.sources) & known_paths))
+
+
+def annotate_stream(lines, known_paths, on_section=None):
+    """
+    Streaming equivalent of parse_sections + annotate_sources + render_sections for a new document:
+    yields the rendered lines of each section (with its metadata line) as soon as the next heading
+    arrives, so only one section is held in memory. `on_section` is called with every completed section.
+    """
+    known_paths = set(known_paths)
+    current = Section()
+    in_fence = False
+
+    def flush(section):
+        if section.heading is not None:
+            section.sources = sorted(mentioned_paths(section, known_paths) | (set(section.sources) & known_paths))
+            if on_section:
+                on_section(section)
+            yield section.heading
+            if section.sources:
+                yield f"<!-- doc-gen: sources={','.join(section.sources)} hash={section.content_hash} -->"
+        yield from section.body
+
+    for line in lines:
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING_RE.match(line)
+        if match:
+            yield from flush(current)
+            current = Section(match.group(2), len(match.group(1)), line)
+            continue
+        meta = META_RE.match(line.strip())
+        if meta and current.heading is not None and not current.body:
+            current.sources = [s for s in meta.group("sources").split(",") if s]
+            continue
+        current.body.append(line)
+    yield from flush(current)
+
+
+def section_dependencies(section, changed_paths):
+    """Return the changed files a section depends on (recorded sources or files it mentions)."""
+    changed_paths = set(changed_paths)
+    return sorted((changed_paths & set(section.sources)) | mentioned_paths(section, changed_paths))
+
+
+def stale_sections(root, changed_paths):
+    """Return (section, changed dependencies) for every section that depends on any of the changed files."""
+    stale = []
+    for section in iter_sections(root):
+        dependencies = section_dependencies(section, changed_paths)
+        if dependencies:
+            stale.append((section, dependencies))
+    return stale
@@ -0,0 +1,153 @@
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import estimate_tokens
+
+WORDS = (
+    "module function class returns documentation repository configuration update parses commit file "
+    "branch summary handles generates reads writes section prompt token cache request response"
+).split()
+
+# Tags stored with each recorded call, so that concurrent callers (e.g. benchmark phases) can tell their calls apart
+CALL_TAGS = contextvars.ContextVar("fake_llm_call_tags", default=())
+
+
+class FakeMessage:
+    """Minimal stand-in for a LangChain AIMessage / AIMessageChunk."""
+
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class FakeChatModel:
+    """
+    Deterministic, offline stand-in for ChatOpenAI.
+
+    The completion is derived from a hash of the prompt, and each call takes `latency` seconds
+    (time to first token) plus `completion_tokens / tokens_per_second` to stream the rest.
+    All calls are recorded, with the current CALL_TAGS, so benchmarks can report prompt and completion token volumes.
+    """
+
+    def __init__(self, latency=0.05, tokens_per_second=500.0, completion_tokens=200, model_name="fake-gpt"):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.model_name = model_name
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _completion(self, prompt):
+        seed = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+        words = [WORDS[seed[i % len(seed)] % len(WORDS)] for i in range(self.completion_tokens)]
+        return f"## Summary\n{' '.join(words)}"
+
+    def _record(self, prompt, completion):
+        usage = {
+            "input_tokens": estimate_tokens(prompt),
+            "output_tokens": estimate_tokens(completion),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        with self._lock:
+            self.calls.append(dict(usage, tags=CALL_TAGS.get()))
+        return usage
+
+    @property
+    def prompt_tokens(self):
+        return sum(call["input_tokens"] for call in self.calls)
+
+    @property
+    def completion_tokens_total(self):
+        return sum(call["output_tokens"] for call in self.calls)
+
+    def _generation_time(self):
+        return self.completion_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def invoke(self, prompt, **kwargs):
+        completion = self._completion(prompt)
+        time.sleep(self.latency + self._generation_time())
+        return FakeMessage(completion, self._record(prompt, completion))
+
+    async def ainvoke(self, prompt, **kwargs):
+        completion = self._completion(prompt)
+        await asyncio.sleep(self.latency + self._generation_time())
+        return FakeMessage(completion, self._record(prompt, completion))
+
+    def stream(self, prompt, **kwargs):
+        completion = self._completion(prompt)
+        self._record(prompt, completion)
+        time.sleep(self.latency)
+        pieces = completion.split(" ")
+        delay = self._generation_time() / len(pieces)
+        for i, piece in enumerate(pieces):
+            time.sleep(delay)
+            yield FakeMessage(piece if i == 0 else f" {piece}")
+
+    async def astream(self, prompt, **kwargs):
+        completion = self._completion(prompt)
+        self._record(prompt, completion)
+        await asyncio.sleep(self.latency)
+        pieces = completion.split(" ")
+        delay = self._generation_time() / len(pieces)
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay)
+            yield FakeMessage(piece if i == 0 else f" {piece}")
+
+
+def serve_fake_chat_endpoint(model=None, host="127.0.0.1", port=0):
+    """
+    Serve `model` as a local OpenAI-compatible `/v1/chat/completions` endpoint (streaming and
+    non-streaming) on a background thread. Point ChatOpenAI at it with
+    `base_url=f"http://{host}:{port}/v1"`. Returns the running server; call `shutdown()` to stop it.
+    """
+    model = model or FakeChatModel()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+            created = int(time.time())
+
+            if request.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for chunk in model.stream(prompt):
+                    event = {"id": "fake", "object": "chat.completion.chunk", "created": created,
+                             "model": model.model_name,
+                             "choices": [{"index": 0, "delta": {"content": chunk.content}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+
+            message = model.invoke(prompt)
+            body = json.dumps({
+                "id": "fake", "object": "chat.completion", "created": created, "model": model.model_name,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": message.content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": message.usage_metadata["input_tokens"],
+                          "completion_tokens": message.usage_metadata["output_tokens"],
+                          "total_tokens": message.usage_metadata["total_tokens"]},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.model = model
+    threading.Thread(target=server.serve_forever, name="fake-chat-endpoint", daemon=True).start()
+    return server
@@ -0,0 +1,290 @@
+import os
+import time
+import threading
+import subprocess
+
+import metrics
+
+# Configurations
+# Defaults to doc_gen_cache/ inside the git directory
+CACHE_DIR = os.getenv("DOC_GEN_CACHE_DIR")
+
+
+def git_common_path(*parts, path="."):
+    """
+    Return a path inside the repository's common git directory. Unlike a hard-coded `.git/...` this
+    also works in linked worktrees and submodules, where `.git` is a file.
+    """
+    try:
+        git_dir = subprocess.run(['git', 'rev-parse', '--git-common-dir'], cwd=path, check=True,
+                                 capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_dir = ".git"
+    return os.path.join(path, git_dir, *parts)
+
+
+def cache_path(*parts):
+    """Return a path inside the doc_gen cache directory (DOC_GEN_CACHE_DIR, or doc_gen_cache/ in the git directory)."""
+    return os.path.join(CACHE_DIR or git_common_path("doc_gen_cache"), *parts)
+
+
+def parse_header(line):
+    """Parse a `git cat-file` header into (sha, type, size), or None for a missing or ambiguous object."""
+    line = line.decode("utf-8").rstrip("\n")
+    # "<spec> missing": the spec itself may contain spaces, so look at the last token first
+    if line.rsplit(None, 1)[-1:] in (["missing"], ["ambiguous"]):
+        return None
+    header = line.split()
+    if len(header) != 3 or not header[2].isdigit():
+        return None
+    return header[0], header[1], int(header[2])
+
+
+class GitRepository:
+    """
+    Git backend that keeps long-lived `git cat-file --batch` and `--batch-check` processes.
+
+    Object metadata, ref resolution and file contents are served by the persistent processes
+    straight from the object database, so no working tree checkout is needed and large
+    repositories do not pay process start-up cost per file. Resolved refs are memoized until
+    `clear_cache()` is called.
+    """
+
+    def __init__(self, path="."):
+        self.path = path
+        self._batch = None
+        self._batch_check = None
+        self._batch_lock = threading.Lock()
+        self._batch_check_lock = threading.Lock()
+        self._refs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self, mode):
+        return subprocess.Popen(
+            ['git', 'cat-file', mode], cwd=self.path,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def close(self):
+        """Terminate the persistent cat-file processes."""
+        for process in (self._batch, self._batch_check):
+            if process is not None and process.poll() is None:
+                process.stdin.close()
+                process.wait()
+        self._batch = None
+        self._batch_check = None
+
+    def clear_cache(self):
+        """Forget memoized refs (call after HEAD or branches may have moved)."""
+        self._refs.clear()
+
+    def run(self, *args, text=True, input=None):
+        """Run a one-off git command in the repository (with `input` on stdin) and return its output."""
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(['git', *args], cwd=self.path, check=True, capture_output=True, text=text,
+                                    input=input)
+        finally:
+            metrics.observe(f"git.{args[0]}", time.perf_counter() - start)
+        return result.stdout
+
+    def object_info(self, spec):
+        """Return (sha, type, size) for an object name such as 'HEAD', '<commit>:<path>' or a blob SHA."""
+        start = time.perf_counter()
+        with self._batch_check_lock:
+            if self._batch_check is None or self._batch_check.poll() is not None:
+                self._batch_check = self._start('--batch-check')
+            self._batch_check.stdin.write(spec.encode("utf-8") + b"\n")
+            self._batch_check.stdin.flush()
+            header = parse_header(self._batch_check.stdout.readline())
+        metrics.observe("git.cat-file-check", time.perf_counter() - start)
+        return header
+
+    def read_object(self, spec):
+        """Return (type, content bytes) of an object, or None if it does not exist."""
+        start = time.perf_counter()
+        with self._batch_lock:
+            if self._batch is None or self._batch.poll() is not None:
+                self._batch = self._start('--batch')
+            self._batch.stdin.write(spec.encode("utf-8") + b"\n")
+            self._batch.stdin.flush()
+            header = parse_header(self._batch.stdout.readline())
+            if header is None:
+                return None
+            content = self._batch.stdout.read(header[2])
+            # Each object is followed by a newline
+            self._batch.stdout.read(1)
+        metrics.observe("git.cat-file", time.perf_counter() - start)
+        return header[1], content
+
+    def rev_parse(self, ref):
+        """Resolve a ref to a full object SHA (memoized)."""
+        if ref not in self._refs:
+            info = self.object_info(ref)
+            if info is None:
+                raise ValueError(f"Unknown revision: {ref}")
+            self._refs[ref] = info[0]
+        return self._refs[ref]
+
+    def read_blob(self, spec, max_bytes=None):
+        """Return the raw bytes of a blob, or None if it is missing, not a blob or larger than max_bytes."""
+        if max_bytes is not None:
+            info = self.object_info(spec)
+            if info is None or info[1] != "blob" or info[2] > max_bytes:
+                return None
+        obj = self.read_object(spec)
+        if obj is None or obj[0] != "blob":
+            return None
+        return obj[1]
+
+    def ls_files(self):
+        """Return (path, blob_sha) pairs for the index, skipping submodules."""
+        entries = []
+        for entry in self.run('ls-files', '-s', '-z').split('\0'):
+            if not entry:
+                continue
+            meta, path = entry.split('\t', 1)
+            mode, blob_sha, _stage = meta.split()
+            if mode != '160000':
+                entries.append((path, blob_sha))
+        return entries
+
+    def ls_tree(self, revision):
+        """Return (path, blob_sha) pairs for every blob in the tree of a revision, without checking it out."""
+        entries = []
+        for entry in self.run('ls-tree', '-r', '-z', self.rev_parse(f"{revision}^{{tree}}")).split('\0'):
+            if not entry:
+                continue
+            meta, path = entry.split('\t', 1)
+            _mode, object_type, blob_sha = meta.split()
+            if object_type == 'blob':
+                entries.append((path, blob_sha))
+        return entries
+
+    def diff(self, old, new="HEAD"):
+        """Return the unified diff between two revisions."""
+        return self.run('diff', f"{old}..{new}")
+
+    def log_oneline(self, since=None, until="HEAD"):
+        """Return `git log --oneline` entries, limited to `since..until` when given."""
+        revisions = f"{since}..{until}" if since else until
+        output = self.run('log', revisions, '--oneline').strip()
+        return output.split("\n") if output else []
+
+    def hash_object(self, data):
+        """Write bytes to the object database as a blob and return its SHA."""
+        return self.run('hash-object', '-w', '--stdin', input=data, text=False).decode("ascii").strip()
+
+    def make_tree(self, base_tree, blobs):
+        """
+        Write a tree equal to `base_tree` (None: an empty tree) with files added or replaced, `blobs` mapping
+        paths to (mode, blob SHA), and return its SHA. Only the directories on the paths of the changed files are
+        read and rewritten (`ls-tree` + `mktree`), so the cost does not depend on the size of the repository and
+        neither the index nor the working tree is involved.
+        """
+        entries = {}
+        if base_tree:
+            for entry in self.run('ls-tree', '-z', base_tree).split('\0'):
+                if entry:
+                    meta, name = entry.split('\t', 1)
+                    entries[name] = meta
+        directories = {}
+        for path, (mode, blob_sha) in blobs.items():
+            name, _, rest = path.partition('/')
+            if rest:
+                directories.setdefault(name, {})[rest] = (mode, blob_sha)
+            else:
+                entries[name] = f"{mode} blob {blob_sha}"
+        for name, children in directories.items():
+            meta = entries.get(name, "").split()
+            subtree = meta[2] if meta[1:2] == ["tree"] else None
+            entries[name] = f"040000 tree {self.make_tree(subtree, children)}"
+        return self.run('mktree', '-z', input="".join(f"{meta}\t{name}\0" for name, meta in entries.items())).strip()
+
+    def ref_tip(self, ref):
+        """Return the commit a full ref name points at right now (not memoized), or None if it does not exist."""
+        return self.run('for-each-ref', '--format=%(objectname)', ref).strip() or None
+
+    def branch_tip(self, branch):
+        """Return the commit a branch points at right now (not memoized), or None if it does not exist."""
+        return self.ref_tip(f"refs/heads/{branch}")
+
+    def tracking_ref(self, branch, remote="origin"):
+        """
+        Return the remote-tracking ref of `branch` (`refs/remotes/<remote>/<branch>`), or None if there is none.
+        When the branch does not exist locally, as in a fresh clone where it only exists on the remote, it is
+        fetched first.
+        """
+        ref = f"refs/remotes/{remote}/{branch}"
+        if self.branch_tip(branch) is None:
+            try:
+                self.run('fetch', '-q', remote, f"+refs/heads/{branch}:{ref}")
+            except subprocess.CalledProcessError:
+                # No such remote or branch (or offline): the branch starts from scratch
+                pass
+        return ref if self.ref_tip(ref) else None
+
+    def is_ancestor(self, commit, descendant):
+        """Return True if `commit` is `descendant` or one of its ancestors."""
+        try:
+            self.run('merge-base', '--is-ancestor', commit, descendant)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def commit_files(self, branch, files, message, base="HEAD", upstream=None, attempts=20):
+        """
+        Commit `files` ({path: bytes}) to `branch` with git plumbing only: the tree of `base` with the files
+        replaced becomes a commit whose parents are the branch's previous tip and `base` (unless the tip already
+        contains it), and the branch is moved with a compare-and-swap `update-ref`. Nothing is checked out, so
+        other jobs can keep using the same clone; a concurrent update of the branch is retried on the new tip.
+        With an `upstream` ref (see tracking_ref()), the commit builds on it when the branch does not exist
+        locally or is behind it, so pushing it is a fast-forward.
+        Returns the new commit's SHA, or the current tip if the files are already committed there.
+        """
+        base_commit = self.rev_parse(base)
+        base_tree = self.rev_parse(f"{base_commit}^{{tree}}")
+        blobs = {path: ("100644", self.hash_object(data)) for path, data in files.items()}
+        tree = self.make_tree(base_tree, blobs)
+        ref = f"refs/heads/{branch}"
+        for _ in range(attempts):
+            tip = self.branch_tip(branch)
+            previous = tip
+            upstream_tip = self.ref_tip(upstream) if upstream else None
+            if upstream_tip is not None and upstream_tip != tip and (tip is None or self.is_ancestor(tip, upstream_tip)):
+                previous = upstream_tip
+            parents = [previous] if previous is not None else []
+            if previous is None or not self.is_ancestor(base_commit, previous):
+                parents.append(base_commit)
+            if previous is not None and self.rev_parse(f"{previous}^{{tree}}") == tree:
+                commit = previous
+            else:
+                commit = self.run('commit-tree', tree, *[arg for parent in parents for arg in ('-p', parent)],
+                                  '-m', message).strip()
+            if commit == tip:
+                return tip
+            try:
+                # The zero SHA as old value means the branch must not exist yet
+                self.run('update-ref', '-m', message.splitlines()[0], ref, commit, tip or "0" * len(commit))
+            except subprocess.CalledProcessError:
+                continue
+            self._refs.pop(branch, None)
+            self._refs.pop(ref, None)
+            self._sync_checkout(ref, blobs)
+            return commit
+        raise RuntimeError(f"{branch} kept moving while committing; gave up after {attempts} attempts")
+
+    def _sync_checkout(self, ref, blobs):
+        """If `ref` is checked out here, stage the committed files so the checkout does not show them as reverted."""
+        try:
+            if self.run('symbolic-ref', '-q', 'HEAD').strip() != ref:
+                return
+        except subprocess.CalledProcessError:
+            return
+        for path, (mode, blob_sha) in blobs.items():
+            self.run('update-index', '--add', '--cacheinfo', f"{mode},{blob_sha},{path}")
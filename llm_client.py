@@ -0,0 +1,398 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any
+
+import metrics
+from response_cache import join_chunks
+from token_budget import count_tokens
+
+# Configurations
+REQUESTS_PER_MINUTE = int(os.getenv("DOC_GEN_REQUESTS_PER_MINUTE", 500))
+TOKENS_PER_MINUTE = int(os.getenv("DOC_GEN_TOKENS_PER_MINUTE", 30000))
+MAX_CONCURRENCY = int(os.getenv("DOC_GEN_MAX_CONCURRENCY", 8))
+MAX_RETRIES = int(os.getenv("DOC_GEN_MAX_RETRIES", 6))
+RETRY_BASE_DELAY = float(os.getenv("DOC_GEN_RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.getenv("DOC_GEN_RETRY_MAX_DELAY", 60.0))
+# Send a backup request when a call (or the first chunk of a stream) takes longer than this; 0 disables hedging
+HEDGE_AFTER_SECONDS = float(os.getenv("DOC_GEN_HEDGE_AFTER_SECONDS", 0))
+
+# Exceptions raised by the OpenAI SDK / LangChain that are worth retrying, matched by name so
+# that this module does not need to import either package.
+RETRYABLE_ERROR_NAMES = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError", "ServiceUnavailableError",
+}
+
+
+def estimate_tokens(prompt):
+    """Count the tokens in a prompt, a string or a list of chat messages, with token_budget.count_tokens."""
+    if isinstance(prompt, str):
+        return count_tokens(prompt)
+    return sum(count_tokens(str(getattr(message, "content", message))) for message in prompt)
+
+
+def is_retryable(error):
+    """Return True for rate limits, timeouts, connection problems and server errors."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def get_retry_after(error):
+    """Return the server-provided Retry-After delay in seconds, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Asynchronous token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` tokens are available and take them."""
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def debit(self, amount):
+        """Take extra tokens after the fact (e.g. when actual usage exceeded the estimate)."""
+        self._refill()
+        self.tokens -= amount
+
+
+class AsyncLLMClient:
+    """
+    Asyncio client around a LangChain chat model (anything with an `ainvoke` method).
+
+    Requests are limited by a requests/min and a tokens/min token bucket and by a concurrency
+    semaphore, identical in-flight requests are coalesced into a single call, and retryable
+    errors (429, timeouts, 5xx) are retried with jittered exponential backoff. With `hedge_after`,
+    a call that has not answered in time is sent a second time and the first response wins. With a
+    `cache` (a ResponseCache), responses are stored on disk and repeated requests are answered from it.
+    """
+
+    def __init__(self, llm, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, hedge_after=HEDGE_AFTER_SECONDS,
+                 cache=None):
+        self.llm = llm
+        self.hedge_after = hedge_after
+        self.cache = cache
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "coalesced": 0, "retries": 0, "failures": 0, "hedged": 0, "hedge_wins": 0,
+                      "cache_hits": 0, "cache_misses": 0}
+        self._inflight = {}
+
+    @staticmethod
+    def request_key(prompt, kwargs):
+        return hashlib.sha256(repr((prompt, sorted(kwargs.items()))).encode("utf-8")).hexdigest()
+
+    async def ainvoke(self, prompt, **kwargs):
+        """Invoke the model, sharing the result with any identical request already in flight."""
+        key = self.request_key(prompt, kwargs)
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        task = asyncio.ensure_future(self._invoke_with_retry(prompt, kwargs))
+        self._inflight[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._inflight.pop(key, None)
+            else:
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+    async def ainvoke_many(self, prompts, **kwargs):
+        """Invoke the model for several prompts concurrently, preserving order."""
+        return await asyncio.gather(*(self.ainvoke(prompt, **kwargs) for prompt in prompts))
+
+    async def _acquire(self, estimated):
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket:
+            await self.token_bucket.acquire(estimated)
+
+    def _retry_delay(self, error, attempt):
+        """Return how long to wait before retrying after `error`, or re-raise it if it should not be retried."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            self.stats["failures"] += 1
+            metrics.incr("llm_failures")
+            raise error
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        delay = max(delay, get_retry_after(error) or 0)
+        self.stats["retries"] += 1
+        metrics.incr("llm_retries")
+        logging.warning(f"LLM request failed ({error}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    async def _hedged(self, start, estimated):
+        """
+        Await `start()`. If it has not finished after `hedge_after` seconds, call `start()` a second time and
+        return whichever succeeds first; the other call is cancelled.
+        """
+        if not self.hedge_after:
+            return await start()
+        tasks = [asyncio.ensure_future(start())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                self.stats["hedged"] += 1
+                metrics.incr("llm_hedged")
+                # The backup is an extra request: count it against the rate limits, but do not wait for them
+                if self.request_bucket:
+                    self.request_bucket.debit(1)
+                if self.token_bucket:
+                    self.token_bucket.debit(estimated)
+                tasks.append(asyncio.ensure_future(start()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.stats["hedge_wins"] += 1
+                            metrics.incr("llm_hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _open_stream(self, prompt, kwargs):
+        stream = self.llm.astream(prompt, **kwargs)
+        return stream, await anext(stream, None)
+
+    def _cached(self, prompt, kwargs):
+        """Return (cache key, cached response or None); (None, None) without a cache."""
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(self.llm, prompt, kwargs)
+        response = self.cache.get(key)
+        self.stats["cache_misses" if response is None else "cache_hits"] += 1
+        return key, response
+
+    async def _invoke_with_retry(self, prompt, kwargs):
+        cache_key, response = self._cached(prompt, kwargs)
+        if response is not None:
+            return response
+        estimated = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            await self._acquire(estimated)
+            try:
+                async with self.semaphore:
+                    self.stats["requests"] += 1
+                    start = time.perf_counter()
+                    response = await self._hedged(lambda: self.llm.ainvoke(prompt, **kwargs), estimated)
+                    elapsed = time.perf_counter() - start
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            # Without streaming the first token arrives together with the full response
+            metrics.observe("llm.time_to_first_token", elapsed)
+            metrics.observe("llm.total", elapsed)
+            self._account_usage(response, estimated)
+            if cache_key is not None:
+                self.cache.put(cache_key, response)
+            return response
+
+    async def astream(self, prompt, **kwargs):
+        """
+        Stream the completion, yielding chunks as they arrive. Rate limits apply as for `ainvoke`, and
+        retryable errors are retried until the first chunk has arrived; after that they are raised, since
+        the caller has already consumed part of the output. A cached response is yielded as one chunk.
+        """
+        cache_key, response = self._cached(prompt, kwargs)
+        if response is not None:
+            yield response
+            return
+        estimated = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            await self._acquire(estimated)
+            async with self.semaphore:
+                self.stats["requests"] += 1
+                start = time.perf_counter()
+                try:
+                    # Hedged on the time to first token
+                    stream, first = await self._hedged(lambda: self._open_stream(prompt, kwargs), estimated)
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                else:
+                    metrics.observe("llm.time_to_first_token", time.perf_counter() - start)
+                    usage, output, chunks = None, [], []
+                    chunk = first
+                    while chunk is not None:
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        output.append(str(chunk.content))
+                        if cache_key is not None:
+                            chunks.append(chunk)
+                        yield chunk
+                        chunk = await anext(stream, None)
+                    metrics.observe("llm.total", time.perf_counter() - start)
+                    self._record_usage(usage, estimated, estimate_tokens("".join(output)))
+                    if chunks:
+                        self.cache.put(cache_key, join_chunks(chunks))
+                    return
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _account_usage(self, response, estimated):
+        usage = getattr(response, "usage_metadata", None)
+        self._record_usage(usage, estimated, estimate_tokens(str(getattr(response, "content", ""))))
+
+    def _record_usage(self, usage, estimated, estimated_output):
+        if not isinstance(usage, dict):
+            metrics.record_tokens(estimated, estimated_output)
+            return
+        metrics.record_tokens(usage.get("input_tokens"), usage.get("output_tokens"))
+        total = usage.get("total_tokens")
+        if self.token_bucket and total and total > estimated:
+            self.token_bucket.debit(total - estimated)
+
+
+class LLMClient:
+    """
+    Synchronous facade over AsyncLLMClient.
+
+    The async client runs on a private event loop in a background thread, so blocking callers
+    (including several worker threads at once) share the same rate limits, retries and
+    in-flight request coalescing. The `kind` of a request (e.g. "summary" or "update") is accepted
+    for compatibility with ModelRouter and ignored.
+    """
+
+    def __init__(self, llm, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+        self.client = self._run(self._create(llm, kwargs))
+
+    @staticmethod
+    async def _create(llm, kwargs):
+        # Build the async client on its own loop so its primitives belong to that loop
+        return AsyncLLMClient(llm, **kwargs)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    @property
+    def llm(self):
+        return self.client.llm
+
+    @property
+    def stats(self):
+        return dict(self.client.stats)
+
+    def invoke(self, prompt, kind=None, **kwargs):
+        """Invoke the model and block until the response is available."""
+        return self._run(self.client.ainvoke(prompt, **kwargs))
+
+    def invoke_many(self, prompts, kind=None, **kwargs):
+        """Invoke the model for several prompts concurrently and block until all have completed."""
+        return self._run(self.client.ainvoke_many(prompts, **kwargs))
+
+    def stream(self, prompt, kind=None, **kwargs):
+        """Stream the completion: chunks are yielded in the calling thread as they arrive."""
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            async for chunk in self.client.astream(prompt, **kwargs):
+                chunks.put(chunk)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        future.add_done_callback(lambda _: chunks.put(done))
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is done:
+                    future.result()
+                    return
+                yield chunk
+        finally:
+            # Stops the request if the caller abandons the stream early
+            future.cancel()
+
+    async def ainvoke(self, prompt, kind=None, **kwargs):
+        """Invoke the model from any event loop; the request still runs on the client's own loop."""
+        future = asyncio.run_coroutine_threadsafe(self.client.ainvoke(prompt, **kwargs), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def as_chat_model(client):
+    """Wrap an LLMClient (or ModelRouter) in a LangChain chat model, so agents and chains go through the same limits."""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    class RateLimitedChatModel(BaseChatModel):
+        client: Any
+
+        @property
+        def _llm_type(self):
+            return "rate-limited-chat"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            if stop is not None:
+                kwargs["stop"] = stop
+            message = self.client.invoke(messages, **kwargs)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            if stop is not None:
+                kwargs["stop"] = stop
+            message = await self.client.ainvoke(messages, **kwargs)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def bind_tools(self, tools, **kwargs):
+            # Tool schemas are sent with every request (OpenAI format, as the wrapped model expects)
+            return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    return RateLimitedChatModel(client=client)
@@ -0,0 +1,241 @@
+import os
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from token_budget import count_tokens
+
+# Configurations
+MAP_REDUCE_MAX_WORKERS = int(os.getenv("DOC_GEN_MAX_WORKERS", 8))
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("DOC_GEN_CHUNK_TOKENS", 12000))
+
+FILE_CHUNK_PROMPT = """You are an expert developer and technical writer.
+Summarize the following part ({part} of {total}) of the file `{path}` for use in project documentation.
+Describe the classes, functions (with signatures) and behaviour it contains. Be concise and specific.
+
+```
+{content}
+```
+"""
+
+MERGE_PROMPT = """You are an expert developer and technical writer.
+Merge the summaries below into a single summary of {subject}.
+Describe its overall purpose, the role of each entry and how they fit together.
+Keep key class and function names, be concise and do not include generic placeholder text.
+
+{content}
+"""
+
+
+def prompt_budget(prompt, max_tokens, **fields):
+    """Return the tokens left for `{content}` in a prompt once the rest of it (with `fields`) is counted."""
+    return max(max_tokens - count_tokens(prompt.format(content="", **fields)), 2)
+
+
+def fit_prefix(text, max_tokens):
+    """Return the longest prefix of `text` of at most `max_tokens` tokens, cut on a line boundary when possible."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind("\n", 0, low)
+    return text[:cut + 1 if cut > 0 else low]
+
+
+def chunk_text(text, max_tokens):
+    """Split text on line boundaries into chunks of at most `max_tokens` tokens."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        tokens = count_tokens(line)
+        # Hard-split single lines that are longer than a whole chunk (e.g. minified code)
+        while tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            head = fit_prefix(line, max_tokens)
+            chunks.append(head)
+            line = line[len(head):]
+            tokens = count_tokens(line)
+        if size + tokens > max_tokens and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks or [""]
+
+
+def pack_chunks(parts, max_tokens):
+    """Greedily pack text parts, in order, into groups whose combined size (with separators) fits `max_tokens`."""
+    groups, current, size = [], [], 0
+    for part in parts:
+        # One more token for the blank line the parts are joined with
+        tokens = count_tokens(part) + 1
+        if current and size + tokens > max_tokens:
+            groups.append(current)
+            current, size = [], 0
+        current.append(part)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def truncate_text(text, max_tokens):
+    """Cut text to at most `max_tokens` tokens, on a line boundary when possible."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    return fit_prefix(text, max(max_tokens - 2, 1)).rstrip("\n") + "\n..."
+
+
+def reduce_texts(parts, subject, generate, max_tokens=MAP_REDUCE_CHUNK_TOKENS, executor=None):
+    """
+    Merge a list of summaries into one. Parts are packed into groups that fit the token budget;
+    when more than one group is needed the groups are merged separately (in parallel if an executor
+    is given) and the results are merged again until a single summary remains.
+
+    Every round makes fewer parts: only groups of two or more parts are merged (a part left alone is
+    carried over as it is), and when no two parts fit together, e.g. because the merged summaries are
+    more than half the budget, the parts are truncated to half the budget so they can be merged in pairs.
+    """
+    budget = prompt_budget(MERGE_PROMPT, max_tokens, subject=subject)
+    if len(parts) == 1 and count_tokens(parts[0]) <= max_tokens:
+        return parts[0]
+    parts = [truncate_text(part, budget - 1) for part in parts]
+    while True:
+        groups = pack_chunks(parts, budget)
+        if len(parts) > 1 and len(groups) == len(parts):
+            logging.warning(f"Summaries of {subject} are too large to be merged within {max_tokens} tokens; truncating them")
+            parts = [truncate_text(part, budget // 2 - 1) for part in parts]
+            groups = pack_chunks(parts, budget)
+        merge = [group for group in groups if len(group) > 1 or len(groups) == 1]
+        prompts = [MERGE_PROMPT.format(subject=subject, content="\n\n".join(group)) for group in merge]
+        if executor is not None and len(prompts) > 1:
+            merged = iter(list(executor.map(generate, prompts)))
+        else:
+            merged = iter([generate(prompt) for prompt in prompts])
+        parts = [next(merged) if len(group) > 1 or len(groups) == 1 else group[0] for group in groups]
+        if len(parts) == 1:
+            return parts[0]
+
+
+def summarize_content(path, content, generate, file_prompt, max_tokens=MAP_REDUCE_CHUNK_TOKENS):
+    """Summarize a single file, splitting it into budget-sized parts when it is too large for one request."""
+    prompt = file_prompt.format(path=path, content=content)
+    if count_tokens(prompt) <= max_tokens:
+        return generate(prompt)
+    # Part numbers are not known yet; count them at their widest
+    chunks = chunk_text(content, prompt_budget(FILE_CHUNK_PROMPT, max_tokens, path=path, part=99999, total=99999))
+    parts = [
+        generate(FILE_CHUNK_PROMPT.format(path=path, part=i, total=len(chunks), content=chunk))
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    return reduce_texts(parts, f"the file `{path}`", generate, max_tokens)
+
+
+def build_directory_tree(paths):
+    """Map every directory ('' for the repository root) to its direct child files and subdirectories."""
+    tree = {"": {"files": [], "dirs": set()}}
+    for path in paths:
+        parent = posixpath.dirname(path)
+        child = path
+        tree.setdefault(parent, {"files": [], "dirs": set()})["files"].append(path)
+        # Register every ancestor directory up to the root
+        while parent:
+            child, parent = parent, posixpath.dirname(parent)
+            tree.setdefault(child, {"files": [], "dirs": set()})
+            tree.setdefault(parent, {"files": [], "dirs": set()})["dirs"].add(child)
+    return tree
+
+
+def _directory_key(entries):
+    """Content-address a directory summary by the names and keys of its children."""
+    digest = hashlib.sha1(b"dir\0")
+    for name, key in sorted(entries):
+        digest.update(f"{name}\0{key}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def summarize_repository(blobs, read_blob, generate, file_prompt, cache=None,
+                         max_workers=MAP_REDUCE_MAX_WORKERS, max_tokens=MAP_REDUCE_CHUNK_TOKENS, cache_key=None):
+    """
+    Summarize a repository hierarchically and return the summaries of the top-level entries.
+
+    1. Map: every file is summarized in parallel (reusing cached summaries by blob SHA).
+    2. Reduce: directories are summarized from their children, deepest level first, with all
+       directories of the same depth processed in parallel.
+
+    Latency therefore grows with the depth of the tree rather than with the number of bytes.
+    `blobs` is a list of (path, blob_sha) pairs, `read_blob(blob_sha, path)` returns a file's text and
+    `generate` turns a prompt into a completion. `cache_key(blob_sha)` returns the cache key of a file's summary
+    (by default the blob SHA itself); directory keys are derived from the keys of their children.
+    """
+    summaries = {}
+    keys = {path: cache_key(blob_sha) if cache_key else blob_sha for path, blob_sha in blobs}
+
+    def cached(key, compute):
+        summary = cache.get(key) if cache is not None else None
+        if summary is None:
+            summary = compute()
+            if cache is not None and summary is not None:
+                cache.put(key, summary)
+        return summary
+
+    def map_file(item):
+        path, blob_sha = item
+
+        def compute():
+            content = read_blob(blob_sha, path)
+            if content is None:
+                logging.warning(f"Skipping binary file {path}")
+                return None
+            return summarize_content(path, content, generate, file_prompt, max_tokens)
+
+        return path, cached(keys[path], compute)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for path, summary in executor.map(map_file, blobs):
+            if summary is not None:
+                summaries[path] = summary
+
+        tree = build_directory_tree([path for path in keys if path in summaries])
+        directories = sorted((d for d in tree if d), key=lambda d: d.count("/"), reverse=True)
+
+        def reduce_directory(directory):
+            children = sorted(tree[directory]["files"]) + sorted(tree[directory]["dirs"])
+            children = [child for child in children if child in summaries]
+            key = _directory_key((child, keys[child]) for child in children)
+            parts = [f"### {child}\n{summaries[child]}" for child in children]
+            summary = cached(key, lambda: reduce_texts(parts, f"the directory `{directory}/`", generate, max_tokens))
+            return directory, key, summary
+
+        depth = None
+        level = []
+        for directory in directories + [None]:
+            current_depth = directory.count("/") if directory is not None else None
+            if level and current_depth != depth:
+                for name, key, summary in executor.map(reduce_directory, level):
+                    summaries[name] = summary
+                    keys[name] = key
+                level = []
+            depth = current_depth
+            if directory is not None:
+                level.append(directory)
+
+    if cache is not None:
+        cache.flush()
+
+    root = sorted(tree[""]["files"]) + sorted(tree[""]["dirs"])
+    parts = [f"### {'Directory' if child in tree else 'File'}: {child}\n{summaries[child]}\n"
+             for child in root if child in summaries]
+    # Keep the final prompt within budget by merging the top level when it is still too large
+    if count_tokens("\n".join(parts)) > max_tokens:
+        return reduce_texts(parts, "the repository", generate, max_tokens)
+    return "\n".join(parts)
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+# Configurations
+# Defaults to doc_gen_metrics.jsonl inside the git directory
+METRICS_FILE = os.getenv("DOC_GEN_METRICS_FILE")
+METRICS_PORT = int(os.getenv("DOC_GEN_METRICS_PORT", 0))
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("DOC_GEN_PROMPT_LOG_SAMPLE_RATE", 1.0))
+PROMPT_LOG_MAX_CHARS = int(os.getenv("DOC_GEN_PROMPT_LOG_MAX_CHARS", 2000))
+
+_lock = threading.Lock()
+_local = threading.local()
+_run_id = os.urandom(6).hex()
+# Finished spans not yet written to the metrics file
+_events = []
+# name -> {"count", "sum", "max"} for every timed operation (spans and git/LLM calls)
+_durations = {}
+# name -> running total
+_counters = {}
+
+
+def observe(name, seconds):
+    """Record the duration of one timed operation."""
+    with _lock:
+        stats = _durations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["sum"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+def incr(name, value=1):
+    """Increase a counter, e.g. prompt or completion tokens."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def record_tokens(prompt_tokens, completion_tokens):
+    """Count the prompt and completion tokens of one LLM call."""
+    incr("prompt_tokens", prompt_tokens or 0)
+    incr("completion_tokens", completion_tokens or 0)
+
+
+def record_event(event_type, **fields):
+    """Record a one-off event (e.g. a model routing decision); events are written to the metrics file on `flush()`."""
+    with _lock:
+        _events.append(dict(fields, type=event_type))
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a phase of the run. Spans nest (the parent is tracked per thread) and are written to the
+    metrics file on `flush()`. Extra attributes can be added to the yielded dict while the span is open.
+    """
+    parent = getattr(_local, "span", None)
+    record = {"type": "span", "name": name, "parent": parent, "attributes": dict(attributes)}
+    _local.span = name
+    start = time.perf_counter()
+    record["start"] = time.time()
+    try:
+        yield record["attributes"]
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.span = parent
+        record["duration_s"] = round(elapsed, 6)
+        observe(name, elapsed)
+        with _lock:
+            _events.append(record)
+
+
+def log_prompt(kind, prompt):
+    """Log a sampled, size-capped excerpt of a prompt instead of printing the whole thing."""
+    incr("prompt_chars", len(prompt))
+    if random.random() >= PROMPT_LOG_SAMPLE_RATE:
+        return
+    excerpt = prompt[:PROMPT_LOG_MAX_CHARS]
+    truncated = f"\n... [{len(prompt) - len(excerpt)} more characters truncated]" if len(prompt) > len(excerpt) else ""
+    logging.info(f"{kind} prompt ({len(prompt)} characters):\n{excerpt}{truncated}")
+
+
+def snapshot():
+    """Return the current counters and duration statistics."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "durations": {name: dict(stats) for name, stats in _durations.items()},
+        }
+
+
+def flush(path=None):
+    """Append the finished spans and a summary line for this run to the JSON-lines metrics file."""
+    if not path and not METRICS_FILE:
+        # Imported here because git_backend itself reports to this module
+        from git_backend import git_common_path
+        path = git_common_path("doc_gen_metrics.jsonl")
+    path = path or METRICS_FILE
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    summary = dict(snapshot(), type="summary")
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in events + [summary]:
+                f.write(json.dumps(dict(record, run_id=_run_id, timestamp=time.time())) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write metrics to {path}: {e}")
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus():
+    """Render counters and durations in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = ["# TYPE doc_gen_duration_seconds summary"]
+    for name, stats in sorted(data["durations"].items()):
+        lines.append(f'doc_gen_duration_seconds_count{{name="{name}"}} {stats["count"]}')
+        lines.append(f'doc_gen_duration_seconds_sum{{name="{name}"}} {stats["sum"]:.6f}')
+    lines.append("# TYPE doc_gen_duration_seconds_max gauge")
+    for name, stats in sorted(data["durations"].items()):
+        lines.append(f'doc_gen_duration_seconds_max{{name="{name}"}} {stats["max"]:.6f}')
+    for name, value in sorted(data["counters"].items()):
+        metric = f"doc_gen_{_metric_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port=METRICS_PORT, host="127.0.0.1"):
+    """Serve `/metrics` in Prometheus text format on a background thread. Returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,128 @@
+"""
+Size-aware model routing.
+
+Every request is sent to one of two model tiers: full-repository generation, and anything larger than
+DOC_GEN_SMALL_MODEL_MAX_TOKENS, goes to the large model. Small updates, section rewrites and file summaries go to
+a cheaper and faster one. Each tier has its own LLMClient (rate limits, retries, hedging), and every routing
+decision is written to the metrics file together with the latency measured for it.
+"""
+import os
+import time
+import asyncio
+import threading
+
+import metrics
+from llm_client import LLMClient, estimate_tokens
+
+# Configurations
+LARGE_MODEL = os.getenv("DOC_GEN_LARGE_MODEL", "gpt-4o")
+SMALL_MODEL = os.getenv("DOC_GEN_SMALL_MODEL", "gpt-4o-mini")
+# Prompts up to this many tokens go to the small model; 0 sends everything to the large model
+SMALL_MODEL_MAX_TOKENS = int(os.getenv("DOC_GEN_SMALL_MODEL_MAX_TOKENS", 8000))
+# Kinds of request that always go to the large model, whatever their size
+LARGE_MODEL_KINDS = {kind.strip() for kind in os.getenv("DOC_GEN_LARGE_MODEL_KINDS", "initial").split(",") if kind.strip()}
+# Endpoint of each tier (defaults to OPENAI_BASE_URL), e.g. local fake chat endpoints for testing
+LARGE_MODEL_BASE_URL = os.getenv("DOC_GEN_LARGE_MODEL_BASE_URL")
+SMALL_MODEL_BASE_URL = os.getenv("DOC_GEN_SMALL_MODEL_BASE_URL")
+
+
+class ModelRouter:
+    """
+    Drop-in replacement for LLMClient that sends each request to the "small" or "large" client, based on
+    the size of the prompt and its `kind` ("initial", "update", "section", "summary", ...). Without a
+    "small" client every request goes to the large one.
+    """
+
+    def __init__(self, clients, small_max_tokens=SMALL_MODEL_MAX_TOKENS, large_kinds=LARGE_MODEL_KINDS):
+        self.clients = clients
+        self.small_max_tokens = small_max_tokens
+        self.large_kinds = set(large_kinds)
+        self.routes = {tier: 0 for tier in clients}
+        self._lock = threading.Lock()
+
+    def route(self, prompt, kind=None):
+        """Return the tier for a request and the estimated size of its prompt in tokens."""
+        tokens = estimate_tokens(prompt)
+        small = "small" in self.clients and kind not in self.large_kinds and tokens <= self.small_max_tokens
+        return ("small" if small else "large"), tokens
+
+    def _record(self, tier, kind, tokens, start, ok, first_token=None):
+        latency = time.perf_counter() - start
+        metrics.observe(f"llm.{tier}", latency)
+        llm = self.clients[tier].llm
+        event = {"tier": tier, "model": getattr(llm, "model_name", None) or type(llm).__name__, "kind": kind,
+                 "prompt_tokens": tokens, "latency_s": round(latency, 6), "ok": ok}
+        if first_token is not None:
+            event["first_token_s"] = round(first_token, 6)
+        metrics.record_event("llm_route", **event)
+        with self._lock:
+            self.routes[tier] += 1
+
+    @property
+    def llm(self):
+        return self.clients["large"].llm
+
+    @property
+    def stats(self):
+        """Totals over all tiers, plus the number of requests routed to each tier and per-tier statistics."""
+        tiers = {tier: client.stats for tier, client in self.clients.items()}
+        totals = {}
+        for stats in tiers.values():
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+        with self._lock:
+            return dict(totals, routes=dict(self.routes), tiers=tiers)
+
+    def invoke(self, prompt, kind=None, **kwargs):
+        tier, tokens = self.route(prompt, kind)
+        start, ok = time.perf_counter(), False
+        try:
+            response = self.clients[tier].invoke(prompt, **kwargs)
+            ok = True
+            return response
+        finally:
+            self._record(tier, kind, tokens, start, ok)
+
+    async def ainvoke(self, prompt, kind=None, **kwargs):
+        tier, tokens = self.route(prompt, kind)
+        start, ok = time.perf_counter(), False
+        try:
+            response = await self.clients[tier].ainvoke(prompt, **kwargs)
+            ok = True
+            return response
+        finally:
+            self._record(tier, kind, tokens, start, ok)
+
+    def invoke_many(self, prompts, kind=None, **kwargs):
+        """Route and invoke several prompts concurrently (possibly on different tiers), preserving order."""
+        async def invoke_all():
+            return await asyncio.gather(*(self.ainvoke(prompt, kind, **kwargs) for prompt in prompts))
+        return asyncio.run(invoke_all())
+
+    def stream(self, prompt, kind=None, **kwargs):
+        tier, tokens = self.route(prompt, kind)
+        start, ok, first_token = time.perf_counter(), False, None
+        try:
+            for chunk in self.clients[tier].stream(prompt, **kwargs):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield chunk
+            ok = True
+        finally:
+            self._record(tier, kind, tokens, start, ok, first_token)
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+
+
+def build_router(make_llm, cache=None):
+    """
+    Create the model clients for both tiers: `make_llm(model, base_url)` builds a chat model (e.g. ChatOpenAI).
+    The small tier is left out when routing is disabled (DOC_GEN_SMALL_MODEL_MAX_TOKENS=0 or no small model).
+    Both tiers share the response `cache`, if any (its keys include the model).
+    """
+    clients = {"large": LLMClient(make_llm(LARGE_MODEL, LARGE_MODEL_BASE_URL), cache=cache)}
+    if SMALL_MODEL and SMALL_MODEL_MAX_TOKENS:
+        clients["small"] = LLMClient(make_llm(SMALL_MODEL, SMALL_MODEL_BASE_URL), cache=cache)
+    return ModelRouter(clients)
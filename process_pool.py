@@ -0,0 +1,117 @@
+import os
+import secrets
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import BaseManager, BaseProxy
+
+
+class LLMClientProxy(BaseProxy):
+    """Worker-side handle on the parent's LLMClient."""
+    _exposed_ = ("invoke", "invoke_many")
+
+    def invoke(self, prompt, **kwargs):
+        return self._callmethod("invoke", (prompt,), kwargs)
+
+    def invoke_many(self, prompts, **kwargs):
+        return self._callmethod("invoke_many", (prompts,), kwargs)
+
+
+class SummaryCacheProxy(BaseProxy):
+    """Worker-side handle on the parent's SummaryCache."""
+    _exposed_ = ("get", "put", "flush", "__len__", "__contains__", "__getattribute__")
+
+    def get(self, blob_sha):
+        return self._callmethod("get", (blob_sha,))
+
+    def put(self, blob_sha, summary):
+        return self._callmethod("put", (blob_sha, summary))
+
+    def flush(self):
+        return self._callmethod("flush")
+
+    def __len__(self):
+        return self._callmethod("__len__")
+
+    def __contains__(self, blob_sha):
+        return self._callmethod("__contains__", (blob_sha,))
+
+    @property
+    def hits(self):
+        return self._callmethod("__getattribute__", ("hits",))
+
+    @property
+    def misses(self):
+        return self._callmethod("__getattribute__", ("misses",))
+
+
+class SharedStateManager(BaseManager):
+    """Serves the parent's LLM client and summary cache to worker processes."""
+
+
+SharedStateManager.register("llm_client", proxytype=LLMClientProxy)
+SharedStateManager.register("summary_cache", proxytype=SummaryCacheProxy)
+
+# Keeps the worker's connection to the parent alive
+_manager = None
+
+
+def _init_worker(address, authkey):
+    global _manager
+    import doc_gen
+    from git_backend import GitRepository
+
+    _manager = SharedStateManager(address=address, authkey=authkey)
+    _manager.connect()
+    doc_gen.llm_client = _manager.llm_client()
+    doc_gen.summary_cache = _manager.summary_cache()
+    doc_gen.repo = GitRepository()
+
+
+class SharedProcessPool:
+    """
+    Process pool whose workers send every LLM request through the parent's LLMClient and share its
+    summary cache, so rate limits, retries, request coalescing and cached summaries apply across all
+    workers while CPU-bound work (reading files, parsing, diffing) runs on all cores.
+
+    Workers are started with the "spawn" method (fork is unsafe with the client's event-loop thread),
+    import doc_gen and run in the parent's working directory. Use as a context manager.
+    """
+
+    def __init__(self, max_workers=None, llm_client=None, summary_cache=None):
+        import doc_gen
+
+        if llm_client is None:
+            llm_client = doc_gen.get_llm_client()
+        if summary_cache is None:
+            summary_cache = doc_gen.get_summary_cache()
+
+        class Server(SharedStateManager):
+            pass
+
+        Server.register("llm_client", callable=lambda: llm_client, proxytype=LLMClientProxy)
+        Server.register("summary_cache", callable=lambda: summary_cache, proxytype=SummaryCacheProxy)
+        authkey = secrets.token_bytes(16)
+        self.server = Server(authkey=authkey).get_server()
+        threading.Thread(target=self.server.serve_forever, name="shared-state", daemon=True).start()
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(self.server.address, authkey),
+        )
+        logging.info(f"Started {self.max_workers} worker process(es)")
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self.server.stop_event.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,186 @@
+import os
+import json
+import codecs
+import fnmatch
+import logging
+import posixpath
+import subprocess
+
+# Configurations
+MAX_FILE_BYTES = int(os.getenv("DOC_GEN_MAX_FILE_BYTES", 1024 * 1024))
+READ_CHUNK_BYTES = 64 * 1024
+SNIFF_BYTES = 8000
+
+# Attributes from .gitattributes that mark a file as not worth documenting
+INGEST_ATTRIBUTES = ["binary", "text", "diff", "linguist-generated", "linguist-vendored"]
+
+# Lockfiles, minified assets and vendored or generated code, skipped even without .gitattributes markers.
+# Patterns without a slash match the file name, the others match the path; extend with DOC_GEN_GENERATED_PATTERNS.
+GENERATED_PATTERNS = [
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb", "poetry.lock",
+    "Pipfile.lock", "uv.lock", "pdm.lock", "Cargo.lock", "composer.lock", "Gemfile.lock", "go.sum", "*.lock",
+    "*.min.js", "*.min.css", "*.map", "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*",
+    "vendor/*", "*/vendor/*", "third_party/*", "*/third_party/*", "node_modules/*", "*/node_modules/*",
+    "dist/*",
+] + [pattern.strip() for pattern in os.getenv("DOC_GEN_GENERATED_PATTERNS", "").split(",") if pattern.strip()]
+
+
+def is_binary(head):
+    """Sniff the first bytes of a file: NUL bytes or mostly non-text bytes mean binary."""
+    if not head:
+        return False
+    if b"\0" in head:
+        return True
+    text_bytes = bytes(range(32, 127)) + b"\n\r\t\f\b"
+    non_text = sum(1 for byte in head if byte not in text_bytes and byte < 128)
+    return non_text / len(head) > 0.3
+
+
+def get_skipped_by_attributes(paths):
+    """
+    Return the subset of paths that .gitattributes marks as binary, generated or vendored
+    (`binary`, `-text`, `-diff`, `linguist-generated`, `linguist-vendored`).
+    A single `git check-attr --stdin` process resolves the attributes for all paths.
+    """
+    if not paths:
+        return set()
+    try:
+        result = subprocess.run(
+            ['git', 'check-attr', '-z', '--stdin'] + INGEST_ATTRIBUTES,
+            input="\0".join(paths).encode("utf-8"), capture_output=True, check=True
+        )
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.warning(f"Could not read .gitattributes: {e}")
+        return set()
+
+    skipped = set()
+    fields = result.stdout.decode("utf-8").split("\0")
+    for path, attribute, value in zip(fields[0::3], fields[1::3], fields[2::3]):
+        if attribute in ("binary", "linguist-generated", "linguist-vendored") and value in ("set", "true"):
+            skipped.add(path)
+        elif attribute in ("text", "diff") and value == "unset":
+            skipped.add(path)
+    return skipped
+
+
+def is_generated_path(path, patterns=None):
+    """True for lockfiles, minified assets and vendored or generated files (see GENERATED_PATTERNS)."""
+    name = posixpath.basename(path)
+    for pattern in GENERATED_PATTERNS if patterns is None else patterns:
+        if fnmatch.fnmatchcase(path if "/" in pattern else name, pattern):
+            return True
+    return False
+
+
+def get_skipped_files(paths):
+    """Return the subset of paths not worth documenting: marked in .gitattributes or matching GENERATED_PATTERNS."""
+    return {path for path in paths if is_generated_path(path)} | get_skipped_by_attributes(paths)
+
+
+def notebook_to_source(text):
+    """
+    Convert a Jupyter notebook to its cell sources in the "percent" format (`# %%` cell markers, markdown as
+    comments), dropping outputs and metadata. IPython magics and shell escapes are commented out, so the
+    result parses as Python. Text that is not a notebook is returned unchanged.
+    """
+    try:
+        cells = json.loads(text)["cells"]
+    except (ValueError, KeyError, TypeError):
+        return text
+    parts = []
+    for cell in cells:
+        source = cell.get("source", "")
+        source = "".join(source) if isinstance(source, list) else source
+        if cell.get("cell_type") == "code":
+            lines = [f"# {line}" if line.lstrip().startswith(("%", "!", "?")) else line for line in source.split("\n")]
+            parts.append("# %%\n" + "\n".join(lines))
+        elif cell.get("cell_type") == "markdown":
+            parts.append("# %% [markdown]\n" + "\n".join(f"# {line}".rstrip() for line in source.split("\n")))
+    return "\n\n".join(parts)
+
+
+# Converters applied to file contents before they go into a prompt, by file extension
+TEXT_CONVERTERS = {".ipynb": notebook_to_source}
+
+
+def prepare_text(path, text):
+    """Return the text of a file as it should appear in a prompt (e.g. notebooks without their outputs)."""
+    converter = TEXT_CONVERTERS.get(posixpath.splitext(path)[1].lower())
+    return converter(text) if converter else text
+
+
+def iter_file_chunks(path, max_file_bytes=MAX_FILE_BYTES, chunk_bytes=READ_CHUNK_BYTES):
+    """
+    Yield the decoded text of a file in chunks of at most `chunk_bytes` bytes.
+    Yields nothing for files that are missing, oversized or detected as binary.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError as e:
+        logging.warning(f"Could not read file {path}: {e}")
+        return
+    if size == 0:
+        yield ""
+        return
+    if size > max_file_bytes:
+        logging.info(f"Skipping {path}: {size} bytes exceeds the {max_file_bytes} byte limit")
+        return
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(min(SNIFF_BYTES, chunk_bytes))
+            if is_binary(head):
+                logging.info(f"Skipping binary file {path}")
+                return
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            data = head
+            while data:
+                text = decoder.decode(data)
+                if text:
+                    yield text
+                data = f.read(chunk_bytes)
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+    except OSError as e:
+        logging.warning(f"Could not read file {path}: {e}")
+
+
+def list_tracked_files():
+    """List all tracked files (this respects .gitignore)."""
+    try:
+        output = subprocess.check_output(['git', 'ls-files', '-z']).decode("utf-8")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error listing repo files: {e}")
+        return []
+    return [f for f in output.split("\0") if f]
+
+
+def iter_repo_content(file_list=None, exclude=(), max_file_bytes=MAX_FILE_BYTES, chunk_bytes=READ_CHUNK_BYTES):
+    """
+    Stream the repository as prompt text: a `### File:` header and fenced content per file.
+    Only one read chunk per file is held in memory at a time.
+    """
+    if file_list is None:
+        file_list = list_tracked_files()
+    skipped = get_skipped_files(file_list)
+
+    separator = ""
+    for f in file_list:
+        if f in exclude or f in skipped or not os.path.isfile(f):
+            continue
+        chunks = iter_file_chunks(f, max_file_bytes, chunk_bytes)
+        if posixpath.splitext(f)[1].lower() in TEXT_CONVERTERS:
+            # Converters need the whole file (e.g. to parse a notebook's JSON)
+            pieces = list(chunks)
+            chunks = iter([prepare_text(f, "".join(pieces))] if pieces else [])
+        body = next(chunks, None)
+        if body is None:
+            continue
+        # Add a header with the file path so the LLM knows which file it is reading
+        yield f"{separator}### File: {f}\n```\n"
+        separator = "\n"
+        yield body
+        yield from chunks
+        yield "\n```\n"
+
@@ -0,0 +1,161 @@
+"""Persistent SQLite cache of model responses, keyed by the normalized prompt, model parameters and arguments."""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import operator
+import threading
+from functools import reduce
+
+import metrics
+from git_backend import cache_path
+
+# Configurations
+RESPONSE_CACHE_ENABLED = os.getenv("DOC_GEN_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("DOC_GEN_RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# 0 keeps entries until they are evicted for space
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("DOC_GEN_RESPONSE_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+
+class CachedMessage:
+    """A cached response of a model that does not return LangChain messages."""
+
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+def normalize_prompt(prompt):
+    """Return a canonical form of a prompt: line endings and trailing whitespace do not change the key."""
+    if isinstance(prompt, str):
+        return "\n".join(line.rstrip() for line in prompt.replace("\r\n", "\n").split("\n")).strip()
+    messages = []
+    for message in prompt:
+        messages.append({
+            "type": getattr(message, "type", type(message).__name__),
+            "content": normalize_prompt(message.content) if isinstance(getattr(message, "content", None), str)
+            else getattr(message, "content", str(message)),
+            "tool_calls": getattr(message, "tool_calls", None) or None,
+            "tool_call_id": getattr(message, "tool_call_id", None),
+        })
+    return messages
+
+
+def model_parameters(llm):
+    """Return the parameters identifying a model's behaviour (LangChain's `_identifying_params` when available)."""
+    params = getattr(llm, "_identifying_params", None)
+    if isinstance(params, dict):
+        return params
+    return {"model_name": getattr(llm, "model_name", type(llm).__name__)}
+
+
+def serialize_message(message):
+    try:
+        from langchain_core.messages import BaseMessage, message_to_dict
+    except ImportError:
+        BaseMessage = None
+    if BaseMessage is not None and isinstance(message, BaseMessage):
+        return {"langchain": message_to_dict(message)}
+    return {"content": message.content, "usage_metadata": getattr(message, "usage_metadata", None)}
+
+
+def deserialize_message(data):
+    if "langchain" in data:
+        from langchain_core.messages import messages_from_dict
+        return messages_from_dict([data["langchain"]])[0]
+    return CachedMessage(data["content"], data.get("usage_metadata"))
+
+
+def join_chunks(chunks):
+    """Merge streamed chunks into one message (LangChain chunks add up; anything else is joined as text)."""
+    try:
+        return reduce(operator.add, chunks)
+    except TypeError:
+        return CachedMessage("".join(str(chunk.content) for chunk in chunks),
+                             next((chunk.usage_metadata for chunk in reversed(chunks)
+                                   if getattr(chunk, "usage_metadata", None)), None))
+
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL expiry and LRU eviction above `max_bytes`, safe across processes."""
+
+    def __init__(self, cache_dir=None, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        cache_dir = cache_dir or cache_path()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def key(llm, prompt, kwargs):
+        """Hash of the normalized prompt, the model's parameters and the request arguments."""
+        data = {"prompt": normalize_prompt(prompt), "model": model_parameters(llm), "kwargs": kwargs}
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def get(self, key):
+        """Return the cached response for a key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and row[1] + self.ttl < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                metrics.incr("llm_cache_misses")
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        metrics.incr("llm_cache_hits")
+        return deserialize_message(json.loads(row[0]))
+
+    def put(self, key, message):
+        """Store a response and evict the least recently used entries if the cache is over its size limit."""
+        try:
+            value = json.dumps(serialize_message(message), default=str)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Not caching a response that cannot be serialized: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (key, value, len(value), now, now))
+            self._evict()
+
+    def _evict(self):
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        excess = (self._db.execute("SELECT SUM(size) FROM responses").fetchone()[0] or 0) - self.max_bytes
+        if excess <= 0:
+            return
+        keys = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            keys.append(key)
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+        self.evictions += len(keys)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
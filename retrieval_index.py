@@ -0,0 +1,198 @@
+import os
+import re
+import ast
+import json
+import math
+import heapq
+import logging
+import tempfile
+import threading
+
+from git_backend import cache_path
+
+# Configurations
+RETRIEVAL_TOP_K = int(os.getenv("DOC_GEN_RETRIEVAL_TOP_K", 8))
+CHUNK_LINES = int(os.getenv("DOC_GEN_RETRIEVAL_CHUNK_LINES", 60))
+# Documents kept from other branches and older revisions before the index is pruned to the current ones
+RETRIEVAL_MAX_DOCUMENTS = int(os.getenv("DOC_GEN_RETRIEVAL_MAX_DOCUMENTS", 20000))
+BM25_K1 = 1.2
+BM25_B = 0.75
+INDEX_VERSION = 1
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+WORD_PART_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+HEADING_LINE_RE = re.compile(r"^#{1,6}\s")
+STOPWORDS = {
+    "a", "an", "and", "as", "be", "by", "def", "else", "false", "for", "from", "if", "import", "in", "is", "it", "none",
+    "not", "of", "on", "or", "py", "return", "self", "the", "this", "to", "true", "with",
+}
+
+
+def tokenize(text):
+    """Split text into lowercase search terms: whole identifiers plus their snake_case and camelCase parts."""
+    terms = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        parts = [part.lower() for part in WORD_PART_RE.findall(identifier)]
+        whole = identifier.lower()
+        if len(parts) > 1 and whole not in STOPWORDS:
+            terms.append(whole)
+        terms.extend(part for part in parts if len(part) > 1 and part not in STOPWORDS)
+    return terms
+
+
+def chunk_ranges(path, text, max_lines=CHUNK_LINES):
+    """Return 1-based (start, end) line ranges of at most `max_lines` lines, split at definitions and headings."""
+    lines = text.split("\n")
+    starts = {1}
+    if path.endswith(".py"):
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError):
+            tree = None
+        for node in tree.body if tree else []:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                starts.add(min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]))
+    elif path.endswith(".md"):
+        starts.update(number for number, line in enumerate(lines, 1) if HEADING_LINE_RE.match(line))
+
+    bounds = sorted(start for start in starts if start <= len(lines)) + [len(lines) + 1]
+    pieces = []
+    for start, stop in zip(bounds, bounds[1:]):
+        while stop - start > max_lines:
+            pieces.append([start, start + max_lines - 1])
+            start += max_lines
+        pieces.append([start, stop - 1])
+
+    ranges = []
+    for start, end in pieces:
+        if ranges and end - ranges[-1][0] < max_lines:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [tuple(chunk) for chunk in ranges]
+
+
+class RetrievalIndex:
+    """Persistent local BM25 index over file chunks and documentation sections, keyed by blob SHA or content hash."""
+
+    def __init__(self, cache_dir=None, max_documents=RETRIEVAL_MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self.index_dir = os.path.join(cache_dir or cache_path(), "retrieval")
+        self.index_path = os.path.join(self.index_dir, "index.json")
+        # key -> {"chunks": [[start, end, length], ...], "terms": [term, ...]}
+        self.documents = {}
+        # term -> {key: [[chunk number, term frequency], ...]}
+        self.postings = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable retrieval index: {e}")
+            return
+        if data.get("version") != INDEX_VERSION:
+            return
+        self.documents = data["documents"]
+        self.postings = data["postings"]
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _add(self, key, path, text):
+        chunks = []
+        terms = set()
+        for number, (start, end) in enumerate(chunk_ranges(path, text)):
+            frequencies = {}
+            for term in tokenize("\n".join(text.split("\n")[start - 1:end])):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            chunks.append([start, end, sum(frequencies.values())])
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, {}).setdefault(key, []).append([number, frequency])
+            terms.update(frequencies)
+        self.documents[key] = {"chunks": chunks, "terms": sorted(terms)}
+
+    def _remove(self, key):
+        for term in self.documents.pop(key)["terms"]:
+            postings = self.postings.get(term, {})
+            postings.pop(key, None)
+            if not postings:
+                self.postings.pop(term, None)
+
+    def prune(self, keep):
+        """Remove every document whose key is not in `keep`. Returns the number removed."""
+        with self._lock:
+            removed = [key for key in self.documents if key not in keep]
+            for key in removed:
+                self._remove(key)
+            if removed:
+                self._dirty = True
+        return len(removed)
+
+    def update(self, documents, read_text):
+        """Index the (path, key) documents not indexed yet, pruning old ones above `max_documents`."""
+        wanted = {}
+        for path, key in documents:
+            wanted.setdefault(key, path)
+        with self._lock:
+            added = 0
+            for key, path in wanted.items():
+                if key in self.documents:
+                    continue
+                text = read_text(key, path)
+                if text is None:
+                    continue
+                self._add(key, path, text)
+                self._dirty = True
+                added += 1
+        if len(self.documents) > self.max_documents:
+            removed = self.prune(wanted)
+            logging.info(f"Retrieval index: pruned {removed} document(s) that are no longer current")
+        if added:
+            logging.info(f"Retrieval index: indexed {added} new document(s), {len(self.documents)} in total")
+        return added
+
+    def search(self, query, documents, k=RETRIEVAL_TOP_K, exclude=()):
+        """Return the `k` best (path, key, start, end, score) chunks among `documents` for a query."""
+        exclude = set(exclude)
+        paths = {}
+        for path, key in documents:
+            if path not in exclude and key in self.documents:
+                paths.setdefault(key, path)
+        with self._lock:
+            lengths = [chunk[2] for key in paths for chunk in self.documents[key]["chunks"]]
+            if not lengths:
+                return []
+            average_length = sum(lengths) / len(lengths) or 1
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = [(key, hits) for key, hits in self.postings.get(term, {}).items() if key in paths]
+                frequency = sum(len(hits) for _, hits in postings)
+                if not frequency:
+                    continue
+                idf = math.log(1 + (len(lengths) - frequency + 0.5) / (frequency + 0.5))
+                for key, hits in postings:
+                    chunks = self.documents[key]["chunks"]
+                    for number, tf in hits:
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * chunks[number][2] / average_length)
+                        scores[key, number] = scores.get((key, number), 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(paths[key], key, *self.documents[key]["chunks"][number][:2], score)
+                    for (key, number), score in best]
+
+    def flush(self):
+        """Persist the index (atomically, so concurrent runs never see a partial file)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.index_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "documents": self.documents, "postings": self.postings}, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
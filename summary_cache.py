@@ -0,0 +1,107 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from git_backend import cache_path
+
+# Configurations
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("DOC_GEN_SUMMARY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+class SummaryCache:
+    """Persistent on-disk cache of per-file summaries keyed by blob SHA, with LRU eviction above `max_bytes`."""
+
+    def __init__(self, cache_dir=None, max_bytes=SUMMARY_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir or cache_path(), "summaries")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        # Ordered oldest -> most recently used; values are the stored size in bytes
+        self._index = OrderedDict()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable summary cache index: {e}")
+            return
+        for blob_sha, size in entries:
+            if os.path.isfile(self._entry_path(blob_sha)):
+                self._index[blob_sha] = size
+
+    def _entry_path(self, blob_sha):
+        return os.path.join(self.cache_dir, blob_sha[:2], blob_sha)
+
+    @property
+    def total_bytes(self):
+        return sum(self._index.values())
+
+    def __contains__(self, blob_sha):
+        return blob_sha in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, blob_sha):
+        """Return the cached summary for a blob, or None if it has not been summarized yet."""
+        with self._lock:
+            if blob_sha not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._entry_path(blob_sha), "r", encoding="utf-8") as f:
+                    summary = f.read()
+            except OSError:
+                del self._index[blob_sha]
+                self._dirty = True
+                self.misses += 1
+                return None
+            self._index.move_to_end(blob_sha)
+            self._dirty = True
+            self.hits += 1
+            return summary
+
+    def put(self, blob_sha, summary):
+        """Store the summary for a blob and evict old entries if the cache is over budget."""
+        data = summary.encode("utf-8")
+        path = self._entry_path(blob_sha)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            self._index[blob_sha] = len(data)
+            self._index.move_to_end(blob_sha)
+            self._dirty = True
+            self._evict()
+
+    def _evict(self):
+        total = self.total_bytes
+        while total > self.max_bytes and len(self._index) > 1:
+            blob_sha, size = self._index.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self._entry_path(blob_sha))
+            except OSError:
+                pass
+
+    def flush(self):
+        """Persist the LRU index so recency survives across runs."""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(list(self._index.items()), f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
@@ -0,0 +1,151 @@
+import ast
+import hashlib
+import logging
+
+from repo_ingest import prepare_text
+
+# Files whose changes are summarized by symbol (notebooks through their code cells)
+SYMBOL_EXTENSIONS = (".py", ".ipynb")
+
+
+def _decorators(node):
+    return "".join(f"@{ast.unparse(decorator)} " for decorator in node.decorator_list)
+
+
+def _signature(node):
+    """Render a one-line signature for a function or class definition."""
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(kw) for kw in node.keywords]
+        return f"{_decorators(node)}class {node.name}({', '.join(bases)})" if bases else f"{_decorators(node)}class {node.name}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{_decorators(node)}{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _body_hash(node):
+    """Hash a definition's body, ignoring its docstring and nested definitions (which are tracked separately)."""
+    body = node.body
+    if ast.get_docstring(node, clean=False) is not None:
+        body = body[1:]
+    body = [stmt for stmt in body if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+    dumped = "".join(ast.dump(stmt, include_attributes=False) for stmt in body)
+    return hashlib.sha1(dumped.encode("utf-8")).hexdigest()
+
+
+def extract_symbols(source):
+    """
+    Return a mapping of qualified name -> symbol details for every function, method and class in
+    Python source, or None if the source cannot be parsed.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    symbols = {}
+
+    def visit(body, prefix, in_class):
+        for node in body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            name = f"{prefix}{node.name}"
+            if isinstance(node, ast.ClassDef):
+                kind = "class"
+            else:
+                kind = "method" if in_class else "function"
+            symbols[name] = {
+                "kind": kind,
+                "signature": _signature(node),
+                "docstring": ast.get_docstring(node),
+                "body_hash": _body_hash(node),
+            }
+            visit(node.body, f"{name}.", isinstance(node, ast.ClassDef))
+
+    visit(tree.body, "", False)
+    return symbols
+
+
+def diff_symbols(old_source, new_source):
+    """
+    Compare two versions of a Python file and return the added, removed and modified symbols.
+    Either source may be None (added or deleted file). Returns None if a version cannot be parsed.
+    """
+    old = extract_symbols(old_source) if old_source is not None else {}
+    new = extract_symbols(new_source) if new_source is not None else {}
+    if old is None or new is None:
+        return None
+
+    changes = {"added": [], "removed": [], "modified": []}
+    for name in new.keys() - old.keys():
+        changes["added"].append(dict(new[name], name=name))
+    for name in old.keys() - new.keys():
+        changes["removed"].append(dict(old[name], name=name))
+    for name in new.keys() & old.keys():
+        before, after = old[name], new[name]
+        what = [field for field, key in (("signature", "signature"), ("body", "body_hash"), ("docstring", "docstring"))
+                if before[key] != after[key]]
+        if what:
+            changes["modified"].append(dict(after, name=name, changed=what, old_signature=before["signature"]))
+    for entries in changes.values():
+        entries.sort(key=lambda symbol: symbol["name"])
+    return changes
+
+
+def format_symbol_changes(path, changes):
+    """Render symbol changes for one file as compact prompt text."""
+    lines = [f"{path}:"]
+    for symbol in changes["added"]:
+        lines.append(f"  + {symbol['signature']}")
+    for symbol in changes["removed"]:
+        lines.append(f"  - {symbol['signature']}")
+    for symbol in changes["modified"]:
+        if "signature" in symbol["changed"]:
+            lines.append(f"  ~ {symbol['old_signature']}  =>  {symbol['signature']}")
+        else:
+            lines.append(f"  ~ {symbol['signature']}  ({', '.join(symbol['changed'])} changed)")
+        if "docstring" in symbol["changed"] and symbol["docstring"]:
+            lines.append(f"      docstring: {symbol['docstring'].splitlines()[0]}")
+    if len(lines) == 1:
+        lines.append("  (no function, class or signature changes)")
+    return "\n".join(lines)
+
+
+def symbol_changes_by_path(repo, old_revision, changes, new_revision="HEAD"):
+    """
+    Build compact changed-symbol summaries for the Python files and notebooks in a structured diff
+    ({"added": [...], "modified": [...], "deleted": [...], "renamed": [(old, new), ...], "copied": [...]}),
+    reading both versions from the object database of a GitRepository. Renamed and copied files are
+    compared with the file they came from.
+
+    Returns ({path: summary_text}, other_files) where other_files lists the changed paths that could
+    not be summarized by symbols (non-Python files or files that failed to parse).
+    """
+    def read(revision, path):
+        data = repo.read_blob(f"{revision}:{path}")
+        # Notebooks are compared by their code cells
+        return prepare_text(path, data.decode("utf-8", errors="replace")) if data is not None else None
+
+    entries = [(status, path, path) for status in ("added", "modified", "deleted") for path in changes.get(status, [])]
+    entries += [(status, path, old_path) for status in ("renamed", "copied") for old_path, path in changes.get(status, [])]
+
+    summaries, other_files = {}, []
+    for status, path, old_path in entries:
+        if not path.endswith(SYMBOL_EXTENSIONS):
+            other_files.append(path)
+            continue
+        old_source = read(old_revision, old_path) if status != "added" else None
+        new_source = read(new_revision, path) if status != "deleted" else None
+        symbol_changes = diff_symbols(old_source, new_source)
+        if symbol_changes is None:
+            logging.warning(f"Could not parse {path}; falling back to file-level change")
+            other_files.append(path)
+            continue
+        label = f"{status} from {old_path}" if old_path != path else status
+        summaries[path] = format_symbol_changes(f"{path} ({label})", symbol_changes)
+    return summaries, other_files
+
+
+def summarize_symbol_changes(repo, old_revision, changes, new_revision="HEAD"):
+    """Like symbol_changes_by_path, but returns the summaries joined into a single text."""
+    summaries, other_files = symbol_changes_by_path(repo, old_revision, changes, new_revision)
+    return "\n".join(summaries.values()), other_files
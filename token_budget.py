@@ -0,0 +1,208 @@
+import os
+import re
+import ast
+import logging
+import posixpath
+
+import metrics
+
+# Configurations
+PROMPT_TOKEN_BUDGET = int(os.getenv("DOC_GEN_PROMPT_TOKEN_BUDGET", 100000))
+TOKENIZER_ENCODING = os.getenv("DOC_GEN_TOKENIZER_ENCODING", "o200k_base")
+
+ENTRY_POINT_NAMES = {
+    "main.py", "__main__.py", "app.py", "cli.py", "manage.py", "setup.py", "pyproject.toml",
+    "package.json", "index.js", "main.go", "main.rs", "Cargo.toml", "Dockerfile",
+}
+HUNK_HEADER_RE = re.compile(r"^@@ .* @@")
+DIFF_FILE_RE = re.compile(r"^diff --git a/(.*) b/(.*)$")
+IMPORT_RE = re.compile(r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w., ]+))", re.MULTILINE)
+
+_encoder = None
+
+
+def _get_encoder():
+    """Load the offline tiktoken encoding once; False if tiktoken (or its cached encoding) is unavailable."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logging.info(f"tiktoken unavailable ({e}); estimating token counts")
+            _encoder = False
+    return _encoder
+
+
+def count_tokens(text):
+    """Count tokens locally with tiktoken, falling back to an estimate of about 4 characters per token."""
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def module_name(path):
+    """Return the dotted module name of a Python file path ('pkg/__init__.py' -> 'pkg')."""
+    name = path[:-3].replace("/", ".")
+    return name[:-len(".__init__")] if name.endswith(".__init__") else name
+
+
+def python_imports(text):
+    """Return the module names imported by Python source (falls back to a regex for unparsable files)."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        names = set()
+        for from_name, import_names in IMPORT_RE.findall(text):
+            names.update([from_name] if from_name else [n.strip().split(" ")[0] for n in import_names.split(",")])
+        return names
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return names
+
+
+def import_in_degree(imports_by_path):
+    """
+    Count, for every Python file, how many other files import it.
+    `imports_by_path` maps each path to the set of module names it imports.
+    """
+    modules = {}
+    for path in imports_by_path:
+        if path.endswith(".py"):
+            name = module_name(path)
+            modules[name] = path
+            # Allow imports relative to a top-level source directory, e.g. 'src/pkg/mod.py' as 'pkg.mod'
+            if "." in name:
+                modules.setdefault(name.split(".", 1)[1], path)
+    in_degree = dict.fromkeys(imports_by_path, 0)
+    for path, imports in imports_by_path.items():
+        for target in {modules[name] for name in imports if name in modules}:
+            if target != path:
+                in_degree[target] += 1
+    return in_degree
+
+
+def score_file(path, in_degree=0, changed_lines=0, is_entry_point=False):
+    """Rank a file by importance: README, entry points, import in-degree and change size raise the score."""
+    name = posixpath.basename(path)
+    score = 1.0
+    if name.lower().startswith("readme"):
+        score += 100
+    if is_entry_point or name in ENTRY_POINT_NAMES:
+        score += 50
+    score += 10 * in_degree
+    score += min(50, changed_lines / 2)
+    if "/test" in f"/{path}" or name.startswith("test_") or name.endswith("_test.py"):
+        score -= 20
+    # Shallow files are usually more central than deeply nested ones
+    return score - path.count("/")
+
+
+def is_entry_point(text):
+    """Detect a script entry point."""
+    return "__name__ == \"__main__\"" in text or "__name__ == '__main__'" in text
+
+
+def rank_sources(sources):
+    """
+    Turn (path, text) pairs into budget candidates with token counts and importance scores.
+    Sources are consumed one at a time and their text is not retained.
+    """
+    candidates, imports = [], {}
+    for path, text in sources:
+        imports[path] = python_imports(text) if path.endswith(".py") else set()
+        candidates.append({
+            "name": path, "tokens": count_tokens(text) + 10,
+            "entry_point": is_entry_point(text),
+        })
+    in_degree = import_in_degree(imports)
+    for item in candidates:
+        item["score"] = score_file(item["name"], in_degree[item["name"]], is_entry_point=item.pop("entry_point"))
+    return candidates
+
+
+class BudgetPlan:
+    """Result of fitting ranked candidates into a token budget."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.selected = []
+        self.dropped = []
+        self.used = 0
+
+    def report(self):
+        """Human-readable summary of what was dropped to fit the budget."""
+        if not self.dropped:
+            return ""
+        names = ", ".join(dict.fromkeys(item["name"] for item in self.dropped))
+        return f"Omitted to fit the {self.budget} token budget: {names}"
+
+
+def plan_budget(candidates, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Greedily fill a token budget with the highest-scoring candidates.
+
+    Each candidate is a dict with at least "name", "tokens" and "score"; candidates that do not fit are
+    skipped (smaller, lower-ranked ones may still fit). Selected candidates keep their original order.
+    """
+    plan = BudgetPlan(budget)
+    chosen = set()
+    for index, item in sorted(enumerate(candidates), key=lambda pair: -pair[1]["score"]):
+        if plan.used + item["tokens"] <= budget:
+            plan.used += item["tokens"]
+            chosen.add(index)
+    for index, item in enumerate(candidates):
+        (plan.selected if index in chosen else plan.dropped).append(item)
+
+    if plan.dropped:
+        metrics.incr("budget_dropped_items", len(plan.dropped))
+        logging.info(f"{plan.report()} ({plan.used} of {budget} tokens used)")
+    return plan
+
+
+def split_diff_hunks(diff):
+    """Split a unified diff into (path, hunk text) pairs; each hunk carries its file header."""
+    hunks = []
+    path, header, current = None, [], None
+    for line in diff.splitlines(keepends=True):
+        match = DIFF_FILE_RE.match(line)
+        if match:
+            if current:
+                hunks.append((path, "".join(current)))
+            path, header, current = match.group(2), [line], None
+        elif HUNK_HEADER_RE.match(line):
+            if current:
+                hunks.append((path, "".join(current)))
+            current = header + [line]
+        elif current is not None:
+            current.append(line)
+        else:
+            header.append(line)
+    if current:
+        hunks.append((path, "".join(current)))
+    return hunks
+
+
+def plan_diff(diff, budget):
+    """
+    Fit a unified diff into a token budget by keeping the most important hunks (largest changes in
+    the most important files) instead of truncating by character count. Returns (text, plan).
+    """
+    candidates = []
+    for path, hunk in split_diff_hunks(diff):
+        changed_lines = sum(1 for line in hunk.splitlines() if line[:1] in "+-" and line[:3] not in ("+++", "---"))
+        candidates.append({
+            "name": path, "text": hunk, "tokens": count_tokens(hunk),
+            "score": score_file(path, changed_lines=changed_lines),
+        })
+    plan = plan_budget(candidates, budget)
+    text = "".join(item["text"] for item in plan.selected)
+    if plan.dropped:
+        text += f"\n{plan.report()}"
+    return text, plan